@@ -82,6 +82,7 @@ setup(
             'vcs-status = vcs2l.commands.status:main',
             'vcs-svn = vcs2l.commands.custom:svn_main',
             'vcs-validate = vcs2l.commands.validate:main',
+            'vcs-watch = vcs2l.commands.watch:main',
         ]
     },
 )
@@ -0,0 +1,58 @@
+"""
+Measure the scheduling overhead of the executor.
+
+The jobs use no-op clients, so the measured time is the bookkeeping of
+dispatching jobs, resolving dependencies and collecting results.
+The time per job should stay roughly constant when the number of jobs grows.
+
+Run from the repository root: python -m test.benchmark_executor
+"""
+
+import argparse
+import os
+import time
+
+from vcs2l.commands.import_ import add_dependencies
+from vcs2l.executor import execute_jobs
+
+from .test_executor import generate_noop_jobs
+
+
+def generate_paths(number_of_jobs, nested_per_repo=2):
+    paths = []
+    i = 0
+    while len(paths) < number_of_jobs:
+        repo = 'repo%05d' % i
+        paths.append(repo)
+        for j in range(nested_per_repo):
+            paths.append(os.path.join(repo, 'nested%d' % j))
+        i += 1
+    return paths[:number_of_jobs]
+
+
+def benchmark_scheduling_overhead(number_of_jobs, number_of_workers):
+    jobs = generate_noop_jobs(generate_paths(number_of_jobs))
+    add_dependencies(jobs)
+    start = time.perf_counter()
+    results = execute_jobs(jobs, number_of_workers=number_of_workers)
+    duration = time.perf_counter() - start
+    assert len(results) == number_of_jobs
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1000, 2000, 4000, 6000])
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    for number_of_jobs in args.jobs:
+        duration = benchmark_scheduling_overhead(number_of_jobs, args.workers)
+        print(
+            '%6d jobs: %7.3fs total, %6.1fus per job'
+            % (number_of_jobs, duration, duration / number_of_jobs * 1e6)
+        )
+
+
+if __name__ == '__main__':
+    main()
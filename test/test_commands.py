@@ -314,6 +314,40 @@ class TestCommands(StagedReposFile):
         finally:
             rmtree(workdir)
 
+    def test_import_cache_dir(self):
+        workdir = os.path.join(TEST_WORKSPACE, 'import-cache-dir')
+        cache_dir = os.path.join(workdir, 'cache')
+        os.makedirs(workdir)
+        try:
+            for dissociate in (False, True):
+                os.makedirs(os.path.join(workdir, 'repos'))
+                run_command(
+                    'import',
+                    ['--cache-dir', cache_dir, '--input', self.repos_file_path]
+                    + (['--dissociate'] if dissociate else [])
+                    + ['repos'],
+                    subfolder='import-cache-dir',
+                )
+                # the repositories with the same URL share a single mirror
+                mirrors = [
+                    name
+                    for name in os.listdir(os.path.join(cache_dir, 'git'))
+                    if name.endswith('.git')
+                ]
+                self.assertEqual(len(mirrors), 1)
+
+                alternates_path = os.path.join(
+                    workdir, 'repos', 'vcs2l', '.git', 'objects', 'info', 'alternates'
+                )
+                self.assertEqual(os.path.exists(alternates_path), not dissociate)
+                assert_git_at_commit(
+                    os.path.join(workdir, 'repos', 'immutable', 'hash'),
+                    '5b3504594f7354121cf024dc734bf79e270cffd3',
+                )
+                rmtree(os.path.join(workdir, 'repos'))
+        finally:
+            rmtree(workdir)
+
     def test_import_url(self):
         workdir = os.path.join(TEST_WORKSPACE, 'import-url')
         os.makedirs(workdir)
@@ -0,0 +1,158 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import vcs2l.crawler as crawler
+from vcs2l.crawler import find_repositories
+
+
+class TestFindRepositories(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for path, marker in (
+            ('b', '.git'),
+            ('b/nested', '.hg'),
+            ('a/x', '.git'),
+            ('a/y', None),
+            ('c', None),
+        ):
+            os.makedirs(os.path.join(self.temp_dir.name, path))
+            if marker:
+                os.mkdir(os.path.join(self.temp_dir.name, path, marker))
+        # a .git file (e.g. of a worktree) is not a repository
+        with open(os.path.join(self.temp_dir.name, 'c', '.git'), 'w'):
+            pass
+
+    def _find(self, paths, nested=False, max_depth=None):
+        paths = [os.path.join(self.temp_dir.name, path) for path in paths]
+        return [
+            (os.path.relpath(client.path, self.temp_dir.name), client.type)
+            for client in find_repositories(paths, nested=nested, max_depth=max_depth)
+        ]
+
+    def _write_ignore_file(self, path, lines):
+        with open(
+            os.path.join(self.temp_dir.name, path, crawler.IGNORE_FILE), 'w'
+        ) as h:
+            h.write('\n'.join(lines) + '\n')
+
+    def test_order(self):
+        self.assertEqual(self._find(['.']), [('a/x', 'git'), ('b', 'git')])
+        self.assertEqual(
+            self._find(['.'], nested=True),
+            [('a/x', 'git'), ('b', 'git'), ('b/nested', 'hg')],
+        )
+
+    def test_overlapping_paths(self):
+        # each repository is only found once
+        self.assertEqual(self._find(['b', '.']), [('b', 'git'), ('a/x', 'git')])
+        self.assertEqual(self._find(['.', 'b']), [('a/x', 'git'), ('b', 'git')])
+
+    def test_max_depth(self):
+        self.assertEqual(self._find(['.'], max_depth=1), [('b', 'git')])
+        self.assertEqual(
+            self._find(['.'], nested=True, max_depth=2),
+            [('a/x', 'git'), ('b', 'git'), ('b/nested', 'hg')],
+        )
+        # the depth of another base path is relative to itself
+        self.assertEqual(
+            self._find(['.', 'a'], max_depth=1), [('a/x', 'git'), ('b', 'git')]
+        )
+
+    def test_ignore_file(self):
+        self._write_ignore_file('.', ['# comment', '', 'nes*/', '/a/x'])
+        self.assertEqual(self._find(['.'], nested=True), [('b', 'git')])
+        # the patterns of a base path don't apply to other base paths
+        self.assertEqual(self._find(['a']), [('a/x', 'git')])
+
+        self._write_ignore_file('.', ['x'])
+        self.assertEqual(
+            self._find(['.'], nested=True), [('b', 'git'), ('b/nested', 'hg')]
+        )
+
+    def test_skip_metadata_directories(self):
+        os.makedirs(os.path.join(self.temp_dir.name, 'b', '.git', 'modules', '.hg'))
+        self.assertEqual(
+            self._find(['.'], nested=True),
+            [('a/x', 'git'), ('b', 'git'), ('b/nested', 'hg')],
+        )
+
+    def test_limited_lookahead(self):
+        with patch.object(crawler, 'MAX_PENDING', 1):
+            self.assertEqual(
+                self._find(['.'], nested=True),
+                [('a/x', 'git'), ('b', 'git'), ('b/nested', 'hg')],
+            )
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for path, marker in (('a/x', '.git'), ('b', '.hg'), ('c', None)):
+            os.makedirs(os.path.join(self.temp_dir.name, path, marker or ''))
+        self.index_path = os.path.join(
+            self.temp_dir.name, crawler.INDEX_DIRECTORY, 'index.json'
+        )
+
+    def _age(self, mtime):
+        # the index isn't written while directories were modified recently
+        for path, _, _ in os.walk(self.temp_dir.name):
+            os.utime(path, (mtime, mtime))
+
+    def _find(self):
+        return [
+            os.path.relpath(client.path, self.temp_dir.name)
+            for client in find_repositories([self.temp_dir.name], use_index=True)
+        ]
+
+    def test_racy_directories(self):
+        self.assertEqual(self._find(), ['a/x', 'b'])
+        self.assertFalse(os.path.exists(self.index_path))
+
+    def test_create_index_directory(self):
+        # creating the index directory doesn't prevent writing the index
+        self._age(1000)
+        self.assertEqual(self._find(), ['a/x', 'b'])
+        self.assertTrue(os.path.exists(self.index_path))
+        self.assertEqual(os.stat(self.temp_dir.name).st_mtime, 1000)
+
+    def test_reuse_index(self):
+        os.mkdir(os.path.dirname(self.index_path))
+        self._age(1000)
+        self.assertEqual(self._find(), ['a/x', 'b'])
+        self.assertTrue(os.path.exists(self.index_path))
+
+        with patch.object(crawler, '_Crawler', side_effect=AssertionError):
+            self.assertEqual(self._find(), ['a/x', 'b'])
+
+    def test_invalidate_index(self):
+        os.mkdir(os.path.dirname(self.index_path))
+        self._age(1000)
+        self.assertEqual(self._find(), ['a/x', 'b'])
+
+        os.makedirs(os.path.join(self.temp_dir.name, 'c', 'd', '.git'))
+        self.assertEqual(self._find(), ['a/x', 'b', 'c/d'])
+
+        # a removed repository is detected even if it wasn't listed
+        self._age(2000)
+        self.assertEqual(self._find(), ['a/x', 'b', 'c/d'])
+        os.rmdir(os.path.join(self.temp_dir.name, 'b', '.hg'))
+        self._age(2000)
+        self.assertEqual(self._find(), ['a/x', 'c/d'])
+
+    def test_ignore_file_changed(self):
+        os.mkdir(os.path.dirname(self.index_path))
+        ignore_path = os.path.join(self.temp_dir.name, crawler.IGNORE_FILE)
+        with open(ignore_path, 'w') as h:
+            h.write('a\n')
+        self._age(1000)
+        os.utime(ignore_path, (1000, 1000))
+        self.assertEqual(self._find(), ['b'])
+
+        with open(ignore_path, 'w') as h:
+            h.write('b\n')
+        self._age(1000)
+        self.assertEqual(self._find(), ['a/x'])
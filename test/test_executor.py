@@ -0,0 +1,764 @@
+import gc
+import io
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+import warnings
+from queue import Queue
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from urllib.error import HTTPError
+
+from vcs2l.clients.git import GitClient
+from vcs2l.clients.vcs_base import (
+    OutputBuffer,
+    VcsClientBase,
+    load_url,
+    run_command,
+)
+from vcs2l.commands.import_ import add_dependencies
+from vcs2l.executor import (
+    LOCAL,
+    NETWORK,
+    LineStream,
+    OrderedResultWriter,
+    OutputSpool,
+    ResourceLimits,
+    SpooledOutput,
+    ThreadEngine,
+    execute_jobs,
+    output_json_result,
+    output_result,
+)
+from vcs2l.history import JobHistory
+from vcs2l.scheduler import (
+    AdaptiveConcurrency,
+    JobScheduler,
+    get_critical_path_durations,
+)
+
+
+class NoOpCommand(object):
+    command = 'noop'
+
+
+class ValidateCommandStub(NoOpCommand):
+    def __init__(self, url):
+        self.url = url
+
+
+class NoOpClient(object):
+    type = 'noop'
+
+    def __init__(self, path, finished=None):
+        self.path = path
+        self.finished = finished
+
+    def noop(self, _command):
+        if self.finished is not None:
+            self.finished.append(self.path)
+        return {'cmd': '', 'cwd': self.path, 'output': '', 'returncode': 0}
+
+
+class EchoCommand(object):
+    command = 'echo'
+
+
+class EchoClient(NoOpClient):
+    type = 'echo'
+
+    def echo(self, _command):
+        return run_command([sys.executable, '-c', 'print(%r)' % self.path], os.curdir)
+
+
+class SleepCommand(object):
+    command = 'sleep'
+
+
+class SleepClient(NoOpClient):
+    type = 'sleep'
+
+    # spawn a grandchild which keeps the output pipe open as well
+    script = (
+        'import subprocess, sys, time; '
+        "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)']); "
+        'time.sleep(30)'
+    )
+
+    def sleep(self, _command):
+        if self.path.startswith('fast'):
+            return run_command([sys.executable, '-c', 'pass'], os.curdir)
+        return run_command([sys.executable, '-c', self.script], os.curdir)
+
+
+class FlakyCommand(object):
+    command = 'flaky'
+
+
+class FlakyClient(VcsClientBase):
+    type = 'flaky'
+
+    def flaky(self, _command):
+        # fails the first time since the marker file doesn't exist yet
+        script = (
+            'import os, sys; '
+            "exists = os.path.exists('marker'); "
+            "open('marker', 'w').close(); "
+            'sys.exit(0 if exists else 1)'
+        )
+        return self._run_command([sys.executable, '-c', script], retry=1)
+
+
+def generate_noop_jobs(paths, finished=None):
+    command = NoOpCommand()
+    return [
+        {'client': NoOpClient(path, finished=finished), 'command': command}
+        for path in paths
+    ]
+
+
+class TestJobScheduler(unittest.TestCase):
+    def test_dependencies(self):
+        jobs = generate_noop_jobs(['a', os.path.join('a', 'b'), 'c'])
+        add_dependencies(jobs)
+        scheduler = JobScheduler(jobs)
+        self.assertEqual(len(scheduler), 3)
+
+        ready = [scheduler.pop_ready(), scheduler.pop_ready()]
+        self.assertEqual([job['client'].path for job in ready], ['a', 'c'])
+        # the nested job has to wait for its parent
+        self.assertIsNone(scheduler.pop_ready())
+        scheduler.complete(ready[1])
+        self.assertIsNone(scheduler.pop_ready())
+        scheduler.complete(ready[0])
+        self.assertEqual(scheduler.pop_ready()['client'].path, os.path.join('a', 'b'))
+        self.assertEqual(len(scheduler), 0)
+
+    def test_dependency_already_finished(self):
+        jobs = generate_noop_jobs(['a', os.path.join('a', 'b')])
+        add_dependencies(jobs)
+        scheduler = JobScheduler(jobs[:1])
+        scheduler.complete(scheduler.pop_ready())
+        scheduler.add(jobs[1])
+        self.assertIs(scheduler.pop_ready(), jobs[1])
+
+    def test_host_limits(self):
+        jobs = generate_noop_jobs(['a1', 'a2', 'b1', 'c1'])
+        for job, url in zip(
+            jobs,
+            [
+                'https://a.example.com/1.git',
+                'git@A.example.com:2.git',
+                'https://b.example.com/1.git',
+                'file:///tmp/c1',
+            ],
+        ):
+            job['command'] = ValidateCommandStub(url)
+        scheduler = JobScheduler(
+            jobs, host_limits={'b.example.com': 2}, default_host_limit=1
+        )
+
+        ready = [scheduler.pop_ready() for _ in range(3)]
+        # the second job for host a is deferred behind the jobs for other hosts
+        self.assertEqual([job['client'].path for job in ready], ['a1', 'b1', 'c1'])
+        self.assertIsNone(scheduler.pop_ready())
+        self.assertEqual(len(scheduler), 1)
+        scheduler.complete(ready[1])
+        self.assertIsNone(scheduler.pop_ready())
+        scheduler.complete(ready[0])
+        self.assertEqual(scheduler.pop_ready()['client'].path, 'a2')
+
+    def test_priorities(self):
+        jobs = generate_noop_jobs(['a', os.path.join('a', 'b'), 'c', 'd'])
+        add_dependencies(jobs)
+        priorities = get_critical_path_durations(
+            jobs, {id(jobs[1]): 10.0, id(jobs[2]): 5.0, id(jobs[3]): 0.0}
+        )
+        # unknown durations default to the average
+        self.assertEqual(priorities[id(jobs[0])], 5.0 + 10.0)
+        scheduler = JobScheduler()
+        for job in jobs:
+            scheduler.add(job, priority=priorities[id(job)])
+        self.assertEqual(
+            [scheduler.pop_ready()['client'].path for _ in range(3)], ['a', 'c', 'd']
+        )
+
+    def test_delayed(self):
+        now = [0.0]
+        jobs = generate_noop_jobs(['a', 'b', 'c'])
+        scheduler = JobScheduler(clock=lambda: now[0])
+        scheduler.add_delayed(jobs[0], 2.0)
+        scheduler.add_delayed(jobs[1], 1.0)
+        scheduler.add_delayed(jobs[2], 3.0)
+        self.assertEqual(len(scheduler), 3)
+        self.assertIsNone(scheduler.pop_delayed())
+        self.assertEqual(scheduler.get_next_delay(), 1.0)
+
+        scheduler.remove_delayed(jobs[1])
+        self.assertEqual(scheduler.get_next_delay(), 2.0)
+        now[0] = 2.5
+        self.assertIs(scheduler.pop_delayed(), jobs[0])
+        self.assertIsNone(scheduler.pop_delayed())
+        # a removed job can be delayed again
+        scheduler.add_delayed(jobs[1], 0.0)
+        self.assertIs(scheduler.pop_delayed(), jobs[1])
+        self.assertEqual(len(scheduler), 1)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_increase_and_decrease(self):
+        now = [0.0]
+        concurrency = AdaptiveConcurrency(16, initial=2, clock=lambda: now[0])
+
+        def complete_window(duration, congested=False):
+            # jobs of one window run in parallel and complete together
+            now[0] += duration
+            for _ in range(concurrency.limit):
+                concurrency.observe(duration, congested=congested)
+
+        # doubling while the throughput improves
+        complete_window(1.0)
+        self.assertEqual(concurrency.limit, 4)
+        complete_window(1.0)
+        self.assertEqual(concurrency.limit, 8)
+        # no improvement ends the slow start
+        complete_window(2.0)
+        self.assertEqual(concurrency.limit, 8)
+        # retries halve the limit
+        complete_window(1.0, congested=True)
+        self.assertEqual(concurrency.limit, 4)
+        # afterwards the limit grows additively
+        complete_window(1.0)
+        self.assertEqual(concurrency.limit, 5)
+        # rising latency halves the limit
+        complete_window(5.0)
+        self.assertEqual(concurrency.limit, 2)
+
+
+class TestResourceLimits(unittest.TestCase):
+    def test_limit(self):
+        resources = ResourceLimits({NETWORK: 2, LOCAL: None})
+        lock = threading.Lock()
+        running = {NETWORK: 0, LOCAL: 0}
+        maximum = {NETWORK: 0, LOCAL: 0}
+
+        def run(resource):
+            with resources.acquire(resource):
+                with lock:
+                    running[resource] += 1
+                    maximum[resource] = max(maximum[resource], running[resource])
+                time.sleep(0.05)
+                with lock:
+                    running[resource] -= 1
+
+        threads = [
+            threading.Thread(target=run, args=(resource,))
+            for resource in [NETWORK, LOCAL] * 4
+        ]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual(maximum[NETWORK], 2)
+        self.assertEqual(maximum[LOCAL], 4)
+
+    def test_resource_classes(self):
+        client = GitClient('.')
+        self.assertEqual(client._get_resource_class(['git', 'status']), LOCAL)
+        self.assertEqual(
+            client._get_resource_class(['git', '-c', 'a=b', 'fetch', 'origin']),
+            NETWORK,
+        )
+        self.assertEqual(
+            client._get_resource_class(['git', 'remote', 'show', 'origin']), NETWORK
+        )
+        self.assertEqual(client._get_resource_class(['git', 'remote', 'show']), LOCAL)
+
+
+class TestThreadEngine(unittest.TestCase):
+    def test_stop_additional_workers(self):
+        engine = ThreadEngine(Queue(), 1)
+        engine.set_number_of_workers(3)
+        self.assertEqual(len(engine.workers), 3)
+
+        engine.set_number_of_workers(1)
+        for worker in engine.workers:
+            worker.join(timeout=0.1)
+        self.assertEqual(sum(w.is_alive() for w in engine.workers), 1)
+
+        engine.set_number_of_workers(2)
+        self.assertEqual(len(engine.workers), 2)
+        engine.shutdown()
+        self.assertFalse(any(w.is_alive() for w in engine.workers))
+
+
+class TestOutputBuffer(unittest.TestCase):
+    def test_unlimited(self):
+        output = OutputBuffer()
+        output.write(b'foo\n')
+        output.write(b'bar\n')
+        self.assertEqual(output.getvalue(), 'foo\nbar')
+
+    def test_truncated(self):
+        output = OutputBuffer(limit=10)
+        for i in range(10):
+            output.write(b'%d' % i * 3)
+        self.assertEqual(
+            output.getvalue(), '00011\n[... 20 bytes of output truncated ...]\n88999'
+        )
+
+    def test_spilled(self):
+        spool = OutputSpool(threshold=10)
+        output = OutputBuffer(spool=spool)
+        for i in range(10):
+            output.write(b'%d' % i * 3)
+        output.write(b'\n  \n')
+        spooled = output.getvalue()
+        self.assertIsInstance(spooled, SpooledOutput)
+        self.assertEqual(str(spooled), ''.join('%d' % i * 3 for i in range(10)))
+
+        # small outputs are returned as strings
+        output = OutputBuffer(spool=spool)
+        output.write(b'foo\n')
+        self.assertEqual(output.getvalue(), 'foo')
+
+    def test_spilled_truncated(self):
+        output = OutputBuffer(limit=30, spool=OutputSpool(threshold=10))
+        for i in range(10):
+            output.write(b'%d' % i * 6)
+        self.assertEqual(
+            str(output.getvalue()),
+            '000000111111222'
+            + '\n[... 30 bytes of output truncated ...]\n'
+            + '777888888999999',
+        )
+
+
+class TestLoadUrl(unittest.TestCase):
+    def test_backoff(self):
+        responses = [
+            HTTPError('url', 503, 'Service Unavailable', {}, None),
+            HTTPError('url', 503, 'Service Unavailable', {}, None),
+            io.BytesIO(b'data'),
+        ]
+
+        def urlopen(url, timeout):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with patch('vcs2l.clients.vcs_base.urlopen', side_effect=urlopen):
+            with patch('vcs2l.clients.vcs_base._wait_for_retry') as wait:
+                with patch('random.uniform', side_effect=lambda _, b: b):
+                    self.assertEqual(load_url('url', retry=2, retry_period=1), b'data')
+        # the delay doubles with each attempt
+        self.assertEqual([call[0][0] for call in wait.call_args_list], [1, 2])
+
+
+class TestLineStream(unittest.TestCase):
+    def test_partial_lines(self):
+        stderr = io.StringIO()
+        with patch('vcs2l.streams.stderr', stderr):
+            stream = LineStream('repo')
+            stream.write(b'first\nsec')
+            self.assertEqual(stderr.getvalue(), 'repo: first\n')
+            stream.write(b'ond\r\nthird')
+            stream.close()
+        self.assertEqual(stderr.getvalue(), 'repo: first\nrepo: second\nrepo: third\n')
+
+
+class TestOrderedResultWriter(unittest.TestCase):
+    def test_order(self):
+        output = []
+        writer = OrderedResultWriter(
+            ['b', 'a', 'c', 'd'],
+            output_handler=lambda result, hide_empty: output.append(
+                result['client'].path
+            ),
+        )
+        for path in ['c', 'b']:
+            writer({'client': NoOpClient(path)})
+        # the results wait for the alphabetically first one
+        self.assertEqual(output, [])
+        writer({'client': NoOpClient('a')})
+        self.assertEqual(output, ['a', 'b', 'c'])
+        writer({'client': NoOpClient('d')})
+        self.assertEqual(output, ['a', 'b', 'c', 'd'])
+
+    def test_track(self):
+        output = []
+        writer = OrderedResultWriter(
+            output_handler=lambda result, hide_empty: output.append(
+                result['client'].path
+            ),
+        )
+        jobs = writer.track(iter(generate_noop_jobs(['b', 'a'])))
+        next(jobs)
+        writer({'client': NoOpClient('b')})
+        # a job generated later might sort first
+        self.assertEqual(output, [])
+        next(jobs)
+        writer({'client': NoOpClient('a')})
+        self.assertEqual(output, [])
+        self.assertEqual(list(jobs), [])
+        self.assertEqual(output, ['a', 'b'])
+
+
+class TestOutputJsonResult(unittest.TestCase):
+    def test_output(self):
+        results = [
+            {
+                'client': NoOpClient('a'),
+                'cmd': 'noop',
+                'output': 'foo\nbar',
+                'returncode': 0,
+                'duration': 1.5,
+            },
+            {
+                'client': NoOpClient('b'),
+                'cmd': '',
+                'output': 'Skipped',
+                'returncode': NotImplemented,
+                'skipped': True,
+            },
+        ]
+        stdout = io.StringIO()
+        with patch('vcs2l.streams.stdout', stdout):
+            for result in results:
+                output_json_result(result)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(
+            json.loads(lines[0]),
+            {
+                'path': 'a',
+                'type': 'noop',
+                'cmd': 'noop',
+                'returncode': 0,
+                'duration': 1.5,
+                'output': 'foo\nbar',
+            },
+        )
+        data = json.loads(lines[1])
+        self.assertIsNone(data['returncode'])
+        self.assertTrue(data['skipped'])
+
+    def test_hide_empty(self):
+        results = [
+            {'output': '', 'returncode': 0},
+            {'output': '', 'returncode': NotImplemented},
+            {'output': "Same repository as 'a'", 'returncode': None},
+            {'output': '', 'returncode': 1},
+            {'output': 'changes', 'returncode': 0},
+        ]
+        stdout = io.StringIO()
+        with patch('vcs2l.streams.stdout', stdout):
+            for i, result in enumerate(results):
+                result.update({'client': NoOpClient(str(i)), 'cmd': 'noop'})
+                output_json_result(result, hide_empty=True)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual([json.loads(line)['path'] for line in lines], ['3', '4'])
+
+
+class TestExecuteJobs(unittest.TestCase):
+    def test_nested_dependencies(self):
+        finished = []
+        paths = []
+        for i in range(20):
+            paths.append('repo%d' % i)
+            for j in range(5):
+                paths.append(os.path.join('repo%d' % i, 'nested%d' % j))
+        jobs = generate_noop_jobs(paths, finished=finished)
+        add_dependencies(jobs)
+
+        results = execute_jobs(jobs, number_of_workers=4)
+
+        self.assertEqual(len(results), len(paths))
+        self.assertEqual(sorted(finished), sorted(paths))
+        for path in paths:
+            parent = os.path.dirname(path)
+            if parent:
+                self.assertLess(finished.index(parent), finished.index(path))
+
+    def test_workers_are_stopped(self):
+        threads_before = threading.active_count()
+        jobs = generate_noop_jobs(['repo%d' % i for i in range(10)])
+
+        results = execute_jobs(jobs, number_of_workers=4)
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(threading.active_count(), threads_before)
+
+    def test_schedule_by_history(self):
+        with TemporaryDirectory() as temp_dir:
+            history = JobHistory(os.path.join(temp_dir, 'history.sqlite3'))
+            paths = ['repo%d' % i for i in range(5)]
+            results = execute_jobs(generate_noop_jobs(paths), history=history)
+            for result in results:
+                self.assertIn('duration', result)
+
+            jobs = generate_noop_jobs(paths)
+            # pretend the last job took longest in the previous run
+            history.record(
+                [{'duration': 60.0, 'returncode': 0, **jobs[-1]}]
+                + [{'duration': 1.0, 'returncode': 0, **job} for job in jobs[:-1]]
+            )
+            durations = history.get_expected_durations(jobs)
+            self.assertGreater(durations[id(jobs[-1])], 30.0)
+
+            # the durations of unsuccessful jobs aren't recorded
+            history.record(
+                [{'duration': 0.1, 'returncode': 1, **jobs[-1]}]
+                + [
+                    {'duration': 0.1, 'returncode': 1, 'timed_out': True, **job}
+                    for job in jobs[:-1]
+                ]
+            )
+            self.assertEqual(history.get_expected_durations(jobs), durations)
+
+            finished = []
+            jobs = generate_noop_jobs(paths, finished=finished)
+            execute_jobs(jobs, number_of_workers=1, history=history)
+            self.assertEqual(finished[0], paths[-1])
+
+    @unittest.skipIf(sys.platform == 'win32', 'uses process groups')
+    def test_job_timeout(self):
+        jobs = [
+            {'client': SleepClient(path), 'command': SleepCommand()}
+            for path in ['fast', 'slow']
+        ]
+
+        start = time.monotonic()
+        results = execute_jobs(jobs, number_of_workers=2, job_timeout=1.0)
+
+        self.assertLess(time.monotonic() - start, 20)
+        results = {result['client'].path: result for result in results}
+        self.assertEqual(results['fast']['returncode'], 0)
+        self.assertNotIn('timed_out', results['fast'])
+        self.assertTrue(results['slow']['timed_out'])
+        self.assertEqual(results['slow']['returncode'], -signal.SIGKILL)
+        self.assertTrue(results['slow']['output'].startswith('Timed out'))
+
+    @unittest.skipIf(sys.platform == 'win32', 'uses process groups')
+    def test_total_timeout(self):
+        jobs = [
+            {'client': SleepClient(path), 'command': SleepCommand()}
+            for path in ['slow0', 'slow1']
+        ]
+
+        results = execute_jobs(jobs, number_of_workers=1, total_timeout=1.0)
+
+        self.assertEqual(len(results), 2)
+        self.assertTrue(results[0]['timed_out'])
+        # the second job is not started after the total timeout expired
+        self.assertTrue(results[1]['skipped'])
+        self.assertTrue(results[1]['output'].startswith('Timed out'))
+
+    def test_fail_fast(self):
+        jobs = generate_noop_jobs(['repo%d' % i for i in range(5)])
+        jobs[1]['client'].noop = lambda _command: {
+            'cmd': 'false',
+            'cwd': 'repo1',
+            'output': '',
+            'returncode': 1,
+        }
+
+        results = execute_jobs(jobs, number_of_workers=1, fail_fast=True)
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(
+            [result['client'].path for result in results if result.get('skipped')],
+            ['repo2', 'repo3', 'repo4'],
+        )
+        self.assertEqual(
+            results[-1]['output'], "Skipped since the job for 'repo1' failed"
+        )
+
+    def test_job_stream(self):
+        started = threading.Event()
+        jobs = generate_noop_jobs(['repo%d' % i for i in range(3)])
+        noop = jobs[0]['client'].noop
+        jobs[0]['client'].noop = lambda command: started.set() or noop(command)
+
+        def generate():
+            yield jobs[0]
+            # the first job runs before the remaining jobs are generated
+            self.assertTrue(started.wait(5))
+            yield from jobs[1:]
+
+        results = execute_jobs(generate(), number_of_workers=2)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(execute_jobs(iter([])), [])
+
+    @unittest.skipIf(sys.platform == 'win32', 'uses process groups')
+    def test_job_stream_timeout(self):
+        jobs = [
+            {'client': SleepClient(path), 'command': SleepCommand()}
+            for path in ['slow', 'fast']
+        ]
+        reported = threading.Event()
+
+        def generate():
+            yield jobs[0]
+            # the timeout is enforced while the next job is being generated
+            self.assertTrue(reported.wait(10))
+            yield jobs[1]
+
+        results = execute_jobs(
+            generate(),
+            number_of_workers=2,
+            job_timeout=0.5,
+            result_callback=lambda result: reported.set(),
+        )
+
+        results = {result['client'].path: result for result in results}
+        self.assertTrue(results['slow']['timed_out'])
+        self.assertEqual(results['fast']['returncode'], 0)
+
+    def test_job_stream_fail_fast(self):
+        jobs = generate_noop_jobs(['repo%d' % i for i in range(5)])
+        jobs[0]['client'].noop = lambda _command: {
+            'cmd': 'false',
+            'cwd': 'repo0',
+            'output': '',
+            'returncode': 1,
+        }
+
+        results = execute_jobs(iter(jobs), number_of_workers=1, fail_fast=True)
+
+        # the jobs generated after the failure are reported as well
+        self.assertEqual(
+            [result['client'].path for result in results if result.get('skipped')],
+            ['repo1', 'repo2', 'repo3', 'repo4'],
+        )
+
+    @unittest.skipIf(sys.platform == 'win32', 'uses process groups')
+    def test_fail_fast_cancel(self):
+        jobs = [
+            {'client': SleepClient(path), 'command': SleepCommand()}
+            for path in ['slow', 'fast']
+        ]
+        jobs[1]['client'].sleep = lambda _command: run_command(
+            [sys.executable, '-c', 'import sys, time; time.sleep(1); sys.exit(2)'],
+            os.curdir,
+        )
+
+        start = time.monotonic()
+        results = execute_jobs(
+            jobs, number_of_workers=2, fail_fast=True, fail_fast_cancel=True
+        )
+
+        self.assertLess(time.monotonic() - start, 20)
+        results = {result['client'].path: result for result in results}
+        self.assertEqual(results['fast']['returncode'], 2)
+        self.assertTrue(results['slow']['cancelled'])
+        self.assertNotIn('timed_out', results['slow'])
+
+    def test_spooled_output(self):
+        jobs = [
+            {'client': EchoClient(path), 'command': EchoCommand()}
+            for path in ['short', 'x' * 100]
+        ]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            results = execute_jobs(jobs, spool_threshold=50)
+
+            results = {result['client'].path: result for result in results}
+            self.assertEqual(results['short']['output'], 'short')
+            spooled = results['x' * 100]['output']
+            self.assertIsInstance(spooled, SpooledOutput)
+            self.assertEqual(str(spooled), 'x' * 100)
+            stdout = io.StringIO()
+            with patch('vcs2l.streams.stdout', stdout):
+                output_result(results['x' * 100])
+            self.assertEqual(stdout.getvalue().splitlines()[-1], 'x' * 100)
+
+            # the spool is closed once its outputs aren't referenced anymore
+            del results, spooled
+            gc.collect()
+        self.assertEqual([w for w in caught if w.category is ResourceWarning], [])
+
+    def test_max_output(self):
+        jobs = [{'client': EchoClient('x' * 100), 'command': EchoCommand()}]
+
+        results = execute_jobs(jobs, max_output=20)
+
+        self.assertEqual(
+            results[0]['output'],
+            'x' * 10 + '\n[... 81 bytes of output truncated ...]\n' + 'x' * 9,
+        )
+
+    def test_stream(self):
+        jobs = [
+            {'client': EchoClient(path), 'command': EchoCommand()}
+            for path in ('a', 'b')
+        ]
+
+        stderr = io.StringIO()
+        with patch('vcs2l.streams.stderr', stderr):
+            results = execute_jobs(jobs, stream=True)
+        # the full output is still part of the results
+        self.assertEqual(sorted(result['output'] for result in results), ['a', 'b'])
+
+        self.assertEqual(sorted(stderr.getvalue().splitlines()), ['a: a', 'b: b'])
+
+    def test_show_stats(self):
+        jobs = [
+            {'client': EchoClient(path), 'command': EchoCommand()}
+            for path in ('a', 'b')
+        ]
+
+        stderr = io.StringIO()
+        with patch('vcs2l.streams.stderr', stderr):
+            execute_jobs(jobs, show_stats=True)
+
+        lines = stderr.getvalue().splitlines()
+        self.assertRegex(lines[0], r'^Spawned 2 processes in 2 repositories in ')
+        self.assertIn('  bytes of output: 4', lines)
+        name = os.path.basename(sys.executable)
+        self.assertIn('  %s: 2 (' % name, stderr.getvalue())
+
+    def test_retry_frees_worker(self):
+        with TemporaryDirectory() as temp_dir:
+            jobs = [{'client': FlakyClient(temp_dir), 'command': FlakyCommand()}]
+            jobs += generate_noop_jobs(['noop'])
+
+            results = execute_jobs(jobs, number_of_workers=1)
+
+        # the other job runs while the flaky job waits to retry
+        self.assertEqual(
+            [result['client'].path for result in results], ['noop', temp_dir]
+        )
+        self.assertEqual(results[1]['returncode'], 0)
+        self.assertEqual(results[1]['retries'], 1)
+
+    def test_trace_file(self):
+        with TemporaryDirectory() as temp_dir:
+            trace_file = os.path.join(temp_dir, 'trace.json')
+            jobs = [
+                {'client': EchoClient(path), 'command': EchoCommand()}
+                for path in ['repo0', 'repo1']
+            ]
+            execute_jobs(jobs, number_of_workers=2, trace_file=trace_file)
+            with open(trace_file, 'r') as h:
+                events = json.load(h)['traceEvents']
+
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(
+            sorted(event['name'] for event in spans if event['cat'] == 'job'),
+            ['repo0', 'repo1'],
+        )
+        subprocesses = [event for event in spans if event['cat'] == 'subprocess']
+        self.assertEqual(len(subprocesses), 2)
+        self.assertEqual(subprocesses[0]['args']['returncode'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import vcs2l.clients.vcs_base as vcs_base
+import vcs2l.query_cache as query_cache
+from vcs2l.clients.git import (
+    GitClient,
+    GitQuerySession,
+    get_metadata_signature,
+    get_mirror_path,
+)
+from vcs2l.executor import JobState
+from vcs2l.metadata import MetadataCache
+
+from . import StagedReposFile
+
+
+class TestGitQuerySession(StagedReposFile):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.clone_path = os.path.join(cls.temp_dir.name, 'clone')
+        subprocess.check_call(
+            [
+                cls._git,
+                'clone',
+                '--quiet',
+                os.path.join(cls.temp_dir.name, 'gitrepo'),
+                cls.clone_path,
+            ],
+            env=cls._git_env,
+        )
+        subprocess.check_call(
+            [cls._git, 'remote', 'add', 'upstream', 'https://example.com/repo.git'],
+            cwd=cls.clone_path,
+            env=cls._git_env,
+        )
+
+    def test_refs(self):
+        with GitQuerySession(GitClient(self.clone_path)) as session:
+            result = session.get_head_branch()
+            self.assertEqual(result['returncode'], 0)
+            head = result['output']
+            self.assertEqual(head['name'], 'refs/heads/main')
+            self.assertEqual(head['upstream'], 'refs/remotes/origin/main')
+
+            refs = {ref['name']: ref for ref in session.get_refs()['output']}
+            # annotated tags are peeled, lightweight tags are not
+            self.assertEqual(
+                refs['refs/tags/1.1.5']['peeled'], self._tag_hashes['1.1.5']
+            )
+            self.assertIsNone(refs['refs/tags/0.1.26']['peeled'])
+
+            self.assertEqual(session.resolve('HEAD'), head['hash'])
+            self.assertEqual(
+                session.resolve('1.1.4^{commit}'), self._tag_hashes['1.1.4']
+            )
+            self.assertIsNone(session.resolve('no-such-ref'))
+
+            result = session.get_refs_containing(self._tag_hashes['1.1.4'])
+            self.assertIn('refs/remotes/origin/main', result['output'])
+            self.assertIn('refs/tags/1.1.5', result['output'])
+            self.assertNotIn('refs/tags/1.1.3', result['output'])
+
+            result = session.get_head_tracking()
+            self.assertEqual(result['output'], ('', ''))
+
+        # the ref listing has been reused and cat-file was started once
+        self.assertEqual(len(session.cmds), 4)
+
+    def test_remotes(self):
+        with GitQuerySession(GitClient(self.clone_path)) as session:
+            result = session.get_remotes()
+        self.assertEqual(result['returncode'], 0)
+        self.assertEqual(
+            result['output'],
+            [
+                ('origin', os.path.join(self.temp_dir.name, 'gitrepo')),
+                ('upstream', 'https://example.com/repo.git'),
+            ],
+        )
+
+    def test_remote_urls(self):
+        result = GitClient(self.clone_path)._get_remote_urls()
+        self.assertEqual(
+            result['output'],
+            [
+                (os.path.join(self.temp_dir.name, 'gitrepo'), 'origin'),
+                ('https://example.com/repo.git', 'upstream'),
+            ],
+        )
+
+
+class TestQueryCache(StagedReposFile):
+    def test_memoize_read_only_commands(self):
+        path = os.path.join(self.temp_dir.name, 'gitrepo')
+        client = GitClient(path)
+        # a second path to the same repository
+        link = os.path.join(self.temp_dir.name, 'gitrepo-link')
+        os.symlink(path, link)
+        duplicate = GitClient(link)
+        rev_parse = [GitClient._executable, 'rev-parse', 'HEAD']
+
+        spy = patch.object(vcs_base, 'run_command', wraps=vcs_base.run_command)
+        with query_cache.enabled(), spy as run_command:
+            result = client._run_command(rev_parse)
+            self.assertEqual(duplicate._run_command(rev_parse), result)
+            self.assertEqual(run_command.call_count, 1)
+
+            # a mutating command invalidates the cached results
+            tag = [GitClient._executable, 'tag', 'memoized']
+            self.assertEqual(client._run_command(tag)['returncode'], 0)
+            client._run_command(tag[:2] + ['-d', 'memoized'])
+            duplicate._run_command(rev_parse)
+            self.assertEqual(run_command.call_count, 4)
+
+        # without the cache each command is invoked
+        with patch.object(
+            vcs_base, 'run_command', wraps=vcs_base.run_command
+        ) as run_command:
+            client._run_command(rev_parse)
+            client._run_command(rev_parse)
+        self.assertEqual(run_command.call_count, 2)
+
+    def test_large_outputs(self):
+        cache = query_cache.QueryCache()
+        output = 'x' * (query_cache.MAX_OUTPUT_LENGTH + 1)
+        cache.add('repo', 'key', {'output': output, 'returncode': 0}, 0)
+        self.assertEqual(cache.get('repo', 'key'), (None, 0))
+
+        # the output of read-only commands is spooled if requested
+        client = GitClient(os.path.join(self.temp_dir.name, 'gitrepo'))
+        rev_list = [GitClient._executable, 'rev-list', '--all']
+        spy = patch.object(vcs_base, 'run_command', wraps=vcs_base.run_command)
+        with query_cache.enabled(), spy as run_command:
+            client._run_command(rev_list, spool=True)
+        self.assertTrue(run_command.call_args[1]['spool'])
+
+    def test_is_read_only(self):
+        client = GitClient('.')
+        git = GitClient._executable
+        self.assertTrue(client._is_read_only([git, 'rev-parse', 'HEAD']))
+        self.assertTrue(client._is_read_only([git, 'config', '--get', 'color.ui']))
+        self.assertFalse(client._is_read_only([git, 'config', 'color.ui', 'auto']))
+        self.assertTrue(client._is_read_only([git, 'remote']))
+        self.assertFalse(client._is_read_only([git, 'remote', 'show', 'origin']))
+        self.assertTrue(client._is_read_only([git, 'tag', '--points-at', 'HEAD']))
+        self.assertFalse(client._is_read_only([git, 'tag', 'v1']))
+        self.assertFalse(client._is_read_only([git, '-c', 'color.ui=always', 'status']))
+
+
+class TestMetadataCache(StagedReposFile):
+    def _age_git_dir(self, path):
+        # files modified recently can't be cached reliably
+        mtime = time.time() - 60
+        for dirpath, _, filenames in os.walk(os.path.join(path, '.git')):
+            for name in filenames + ['.']:
+                os.utime(os.path.join(dirpath, name), (mtime, mtime))
+
+    def _query_refs(self, client, database):
+        cache = MetadataCache(path=database)
+        state = JobState(metadata_cache=cache)
+        with patch('vcs2l.clients.git.get_current_job_state', return_value=state):
+            with patch.object(
+                client, '_run_command', wraps=client._run_command
+            ) as run_command:
+                with GitQuerySession(client) as session:
+                    refs = session.get_refs()['output']
+        cache.save()
+        return refs, run_command.call_count
+
+    def test_metadata_cache(self):
+        path = os.path.join(self.temp_dir.name, 'gitrepo')
+        database = os.path.join(self.temp_dir.name, 'metadata.sqlite3')
+        client = GitClient(path)
+        self._age_git_dir(path)
+        self.assertIsNotNone(get_metadata_signature(path))
+
+        refs, call_count = self._query_refs(client, database)
+        self.assertEqual(call_count, 1)
+        # answered from the cache of the previous invocation
+        self.assertEqual(self._query_refs(client, database), (refs, 0))
+
+        # a new branch invalidates the cached refs
+        subprocess.check_call(
+            [self._git, 'branch', 'cached'], cwd=path, env=self._git_env
+        )
+        try:
+            self._age_git_dir(path)
+            refs, call_count = self._query_refs(client, database)
+            self.assertEqual(call_count, 1)
+            self.assertIn('refs/heads/cached', [ref['name'] for ref in refs])
+        finally:
+            subprocess.check_call(
+                [self._git, 'branch', '-D', 'cached'], cwd=path, env=self._git_env
+            )
+
+
+class ImportCommandStub(object):
+    def __init__(self, cache_dir, url):
+        self.cache_dir = cache_dir
+        self.url = url
+        self.retry = 0
+
+
+class TestMirrorLock(unittest.TestCase):
+    @unittest.skipIf(sys.platform == 'win32', 'uses file locks')
+    def test_cancel_while_waiting(self):
+        import fcntl  # noqa: PLC0415
+
+        with TemporaryDirectory() as cache_dir:
+            command = ImportCommandStub(cache_dir, 'https://example.com/repo.git')
+            mirror_path = get_mirror_path(cache_dir, command.url)
+            os.makedirs(os.path.dirname(mirror_path))
+            state = JobState()
+            # another invocation holds the lock, e.g. while cloning the mirror
+            with open(mirror_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                timer = threading.Timer(0.2, state.cancel, args=('Timed out',))
+                timer.start()
+                start = time.monotonic()
+                with patch(
+                    'vcs2l.clients.git.get_current_job_state', return_value=state
+                ):
+                    result, path = GitClient('repo')._update_mirror(command)
+                timer.join()
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertIsNone(path)
+        self.assertEqual(result['returncode'], 1)
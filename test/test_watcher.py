@@ -0,0 +1,113 @@
+import argparse
+import os
+import subprocess
+import sys
+import unittest
+from shutil import which
+from tempfile import TemporaryDirectory
+
+from vcs2l.commands.branch import BranchCommand
+from vcs2l.commands.command import add_common_arguments, can_query_watcher
+from vcs2l.commands.status import StatusCommand, get_parser
+from vcs2l.executor import USE_COLOR
+from vcs2l.watcher import PROTOCOL_VERSION, WorkspaceWatcher, query_watcher
+
+
+@unittest.skipIf(not sys.platform.startswith('linux'), 'requires inotify')
+@unittest.skipIf(not which('git'), '`git` was not found')
+class TestWorkspaceWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for name in ('a', 'b'):
+            self._init_repository(name)
+        self.watcher = WorkspaceWatcher(
+            self.temp_dir.name,
+            {'branch': BranchCommand, 'status': StatusCommand},
+            number_of_workers=2,
+        )
+        self.addCleanup(self.watcher.close)
+        self.watcher.crawl()
+
+    def _init_repository(self, name):
+        subprocess.check_call(
+            ['git', 'init', '--quiet', os.path.join(self.temp_dir.name, name)]
+        )
+
+    def _query(self, command='status', **options):
+        response = self.watcher.query(
+            {
+                'version': PROTOCOL_VERSION,
+                'command': command,
+                'options': {'all': False, 'hide_empty': False, 'quiet': False},
+                'nested': False,
+                'max_depth': None,
+                'color': USE_COLOR,
+                **options,
+            }
+        )
+        if 'error' in response:
+            return response['error']
+        # the number of results and of the ones which have been computed again
+        return len(response['results']), response['computed']
+
+    def test_changed_repositories(self):
+        self.assertEqual(self._query(), (2, 2))
+        self.assertEqual(self._query(), (2, 0))
+        # the results of other commands are cached separately
+        self.assertEqual(self._query('branch'), (2, 2))
+
+        with open(os.path.join(self.temp_dir.name, 'b', 'file'), 'w'):
+            pass
+        self.assertEqual(self._query(), (2, 1))
+        self.assertEqual(self._query(), (2, 0))
+
+        os.makedirs(os.path.join(self.temp_dir.name, 'b', 'sub', 'dir'))
+        self.assertEqual(self._query(), (2, 1))
+        # new directories are watched as well
+        with open(os.path.join(self.temp_dir.name, 'b', 'sub', 'dir', 'file'), 'w'):
+            pass
+        self.assertEqual(self._query(), (2, 1))
+
+    def test_durations(self):
+        response = self.watcher.query(
+            {
+                'version': PROTOCOL_VERSION,
+                'command': 'status',
+                'options': {'all': False, 'hide_empty': False, 'quiet': False},
+                'nested': False,
+                'max_depth': None,
+                'color': USE_COLOR,
+            }
+        )
+        # the cached results keep the duration of the job computing them
+        for result in response['results']:
+            self.assertGreater(result['duration'], 0)
+
+    def test_new_repository(self):
+        self.assertEqual(self._query(), (2, 2))
+        self._init_repository('c')
+        # all repositories are found and watched again
+        self.assertEqual(self._query(), (3, 3))
+
+    def test_incompatible_request(self):
+        self.assertIn('different options', self._query(nested=True))
+        self.assertIn("'log'", self._query('log'))
+
+    def test_no_watcher(self):
+        command = StatusCommand(
+            argparse.Namespace(paths=[self.temp_dir.name], quiet=False)
+        )
+        self.assertIsNone(query_watcher(command))
+
+
+class TestCanQueryWatcher(unittest.TestCase):
+    def _parse_args(self, args):
+        parser = get_parser()
+        add_common_arguments(parser)
+        return parser.parse_args(args)
+
+    def test_execution_options(self):
+        self.assertTrue(can_query_watcher(self._parse_args(['--workers', '2'])))
+        for args in (['--stats'], ['--max-output', '100'], ['--fail-fast']):
+            self.assertFalse(can_query_watcher(self._parse_args(args)))
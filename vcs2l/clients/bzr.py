@@ -8,7 +8,10 @@ from vcs2l.util import rmtree
 
 class BzrClient(VcsClientBase):
     type = 'bzr'
+    marker = '.bzr'
     _executable = None
+    network_subcommands = frozenset(['branch', 'checkout', 'pull', 'push'])
+    read_only_subcommands = frozenset(['info', 'revno'])
 
     @staticmethod
     def is_repository(path):
@@ -29,12 +32,12 @@ class BzrClient(VcsClientBase):
     def custom(self, command):
         self._check_executable()
         cmd = [BzrClient._executable] + command.args
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def diff(self, _command):
         self._check_executable()
         cmd = [BzrClient._executable, 'diff']
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def import_(self, command):
         if not command.url:
@@ -147,12 +150,12 @@ class BzrClient(VcsClientBase):
                 }
             if command.limit != 0:
                 cmd_log += ['--limit', '%d' % command.limit]
-            result_log = self._run_command(cmd_log)
+            result_log = self._run_command(cmd_log, spool=True)
             return result_log
         cmd = [BzrClient._executable, 'log']
         if command.limit != 0:
             cmd += ['--limit', '%d' % command.limit]
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def pull(self, _command):
         self._check_executable()
@@ -171,7 +174,7 @@ class BzrClient(VcsClientBase):
     def status(self, _command):
         self._check_executable()
         cmd = [BzrClient._executable, 'status']
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def _get_parent_branch(self):
         cmd = [BzrClient._executable, 'info']
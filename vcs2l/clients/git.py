@@ -1,16 +1,87 @@
+import hashlib
 import os
+import re
 import subprocess
+import time
 from itertools import takewhile
 from shutil import which
 
-from vcs2l.clients.vcs_base import VcsClientBase
-from vcs2l.executor import USE_COLOR
-from vcs2l.util import rmtree
+import vcs2l.stats as stats
+import vcs2l.tracing as tracing
+from vcs2l.clients.vcs_base import (
+    VcsClientBase,
+    _get_session_kwargs,
+    get_command_name,
+)
+from vcs2l.executor import NETWORK, USE_COLOR, get_current_job_state
+from vcs2l.util import RACY_INTERVAL, rmtree
+
+try:
+    import fcntl
+except ImportError:
+    # the mirrors can't be locked, e.g. on Windows
+    fcntl = None
+
+# the subdirectory of the cache directory containing the bare mirrors
+MIRRORS_DIRECTORY = 'git'
+# the mirrors which have been updated by this process already
+_updated_mirrors = set()
+# the interval in seconds of checking if a locked mirror has been unlocked
+LOCK_POLL_INTERVAL = 0.1
+
+
+def get_mirror_path(cache_dir, url):
+    """Get the path of the bare mirror of a repository URL in the cache."""
+    name = os.path.basename(url.rstrip('/'))
+    if name.endswith('.git'):
+        name = name[:-4]
+    # the hash distinguishes URLs with the same repository name
+    name = '%s-%s.git' % (
+        re.sub(r'[^\w.-]', '_', name),
+        hashlib.sha1(url.encode('utf-8')).hexdigest()[:16],
+    )
+    return os.path.join(os.path.abspath(cache_dir), MIRRORS_DIRECTORY, name)
+
+
+def _lock_file(lock_file):
+    """
+    Lock the file exclusively, waiting while another job or process holds it.
+
+    The lock is polled instead of blocking, so a job which has been cancelled
+    (e.g. timed out) while waiting stops waiting.
+
+    :returns: False if the job has been cancelled before acquiring the lock
+    """
+    if _try_lock_file(lock_file):
+        return True
+    with tracing.span('wait for lock', 'lock', path=lock_file.name):
+        while True:
+            state = get_current_job_state()
+            if state is not None and state.cancelled is not None:
+                return False
+            time.sleep(LOCK_POLL_INTERVAL)
+            if _try_lock_file(lock_file):
+                return True
+
+
+def _try_lock_file(lock_file):
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
 
 
 class GitClient(VcsClientBase):
     type = 'git'
+    marker = '.git'
     _executable = None
+    network_subcommands = frozenset(
+        ['clone', 'fetch', 'ls-remote', 'pull', 'push', 'submodule']
+    )
+    read_only_subcommands = frozenset(
+        ['cat-file', 'describe', 'for-each-ref', 'rev-list', 'rev-parse', 'show-ref']
+    )
     _git_version = None
     _config_color_is_auto = None
 
@@ -33,13 +104,45 @@ class GitClient(VcsClientBase):
     def __init__(self, path):
         super(GitClient, self).__init__(path)
 
+    def _get_resource_class(self, cmd):
+        # showing a specific remote queries the remote repository
+        if cmd[1:3] == ['remote', 'show'] and len(cmd) > 3:
+            return NETWORK
+        return super(GitClient, self)._get_resource_class(cmd)
+
+    def _is_read_only(self, cmd):
+        subcommand = get_command_name(cmd).partition(' ')[2]
+        args = cmd[cmd.index(subcommand) + 1 :] if subcommand else []
+        if subcommand == 'config':
+            return any(
+                arg in ('--get', '--get-all', '--get-regexp', '-l', '--list')
+                for arg in args
+            )
+        if subcommand == 'remote':
+            # listing the remotes, showing a specific remote queries it
+            return args in ([], ['-v'], ['show'])
+        if subcommand == 'tag':
+            return not args or any(
+                arg in ('-l', '--list', '--points-at') for arg in args
+            )
+        return super(GitClient, self)._is_read_only(cmd)
+
     def branch(self, command):
         self._check_executable()
+        if not command.all:
+            # only show current branch
+            with GitQuerySession(self) as session:
+                result = session.get_head_branch()
+            if result['returncode']:
+                return result
+            if result['output'] is not None:
+                result['output'] = result['output']['name'][len('refs/heads/') :]
+                return result
+            # let git describe the detached HEAD
         cmd = [GitClient._executable, 'branch']
         result = self._run_command(cmd)
 
         if not command.all and not result['returncode']:
-            # only show current branch
             lines = result['output'].splitlines()
             lines = [line[2:] for line in lines if line.startswith('* ')]
             result['output'] = '\n'.join(lines)
@@ -49,7 +152,7 @@ class GitClient(VcsClientBase):
     def custom(self, command):
         self._check_executable()
         cmd = [GitClient._executable] + command.args
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def diff(self, command):
         self._check_executable()
@@ -57,63 +160,56 @@ class GitClient(VcsClientBase):
         self._check_color(cmd)
         if command.context:
             cmd += ['--unified=%d' % command.context]
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def export(self, command):
         self._check_executable()
+        with GitQuerySession(self) as session:
+            return self._export(command, session)
+
+    def _export(self, command, session):
         exact = command.exact
         if not exact:
-            # determine if a specific branch is checked out or ec is detached
-            cmd_branch = [GitClient._executable, 'rev-parse', '--abbrev-ref', 'HEAD']
-            result_branch = self._run_command(cmd_branch)
+            # determine if a specific branch is checked out or HEAD is detached
+            result_branch = session.get_head_branch()
             if result_branch['returncode']:
-                result_branch['output'] = (
-                    'Could not determine ref: ' + result_branch['output']
-                )
                 return result_branch
-            branch_name = result_branch['output']
-            exact = branch_name == 'HEAD'  # is detached
+            head = result_branch['output']
+            exact = head is None
 
         if not exact:
+            branch_name = head['name'][len('refs/heads/') :]
             # determine the remote of the current branch
-            cmd_remote = [
-                GitClient._executable,
-                'rev-parse',
-                '--abbrev-ref',
-                '@{upstream}',
-            ]
-            result_remote = self._run_command(cmd_remote)
-            if result_remote['returncode']:
-                result_remote['output'] = (
-                    'Could not determine ref: ' + result_remote['output']
-                )
-                return result_remote
-            branch_with_remote = result_remote['output']
+            upstream = head['upstream']
+            if upstream is None:
+                return {
+                    'cmd': ' && '.join(session.cmds),
+                    'cwd': self.path,
+                    'output': 'Could not determine ref: '
+                    "no upstream configured for branch '%s'" % branch_name,
+                    'returncode': 1,
+                }
 
             # determine remote
             suffix = '/' + branch_name
-            assert branch_with_remote.endswith(branch_name), (
-                "'%s' does not end with '%s'" % (branch_with_remote, branch_name)
+            assert upstream.endswith(suffix), "'%s' does not end with '%s'" % (
+                upstream,
+                suffix,
             )
-            remote = branch_with_remote[: -len(suffix)]
-
-            # if a local ref exists with the same name as the remote branch
-            # the result will be prefixed to make it unambiguous
-            prefix = 'remotes/'
+            remote = upstream[: -len(suffix)]
+            prefix = 'refs/remotes/'
             if remote.startswith(prefix):
                 remote = remote[len(prefix) :]
 
             # determine url of remote
-            result_url = self._get_remote_url(remote)
+            result_url = self._get_remote_url(remote, session)
             if result_url['returncode']:
                 return result_url
             url = result_url['output']
 
             # the result is the remote url and the branch name
             return {
-                'cmd': ' && '.join(
-                    [result_branch['cmd'], result_remote['cmd'], result_url['cmd']]
-                ),
+                'cmd': ' && '.join(session.cmds),
                 'cwd': self.path,
                 'output': '\n'.join([url, branch_name]),
                 'returncode': 0,
@@ -122,24 +218,16 @@ class GitClient(VcsClientBase):
 
         else:
             # determine the hash
-            cmd_ref = [GitClient._executable, 'rev-parse', 'HEAD']
-            result_ref = self._run_command(cmd_ref)
+            result_ref = session.get_head_hash()
             if result_ref['returncode']:
-                result_ref['output'] = (
-                    'Could not determine ref: ' + result_ref['output']
-                )
                 return result_ref
             ref = result_ref['output']
 
             # get all remote names
-            cmd_remotes = [GitClient._executable, 'remote']
-            result_remotes = self._run_command(cmd_remotes)
+            result_remotes = session.get_remotes()
             if result_remotes['returncode']:
-                result_remotes['output'] = (
-                    'Could not determine remotes: ' + result_remotes['output']
-                )
                 return result_remotes
-            remotes = result_remotes['output'].splitlines()
+            remotes = [remote for remote, _ in result_remotes['output']]
 
             # prefer origin and upstream remotes
             if 'upstream' in remotes:
@@ -149,39 +237,34 @@ class GitClient(VcsClientBase):
                 remotes.remove('origin')
                 remotes.insert(0, 'origin')
 
+            # determine the remote branches and tags containing the hash
+            containing = []
+            if remotes:
+                result_containing = session.get_refs_containing(ref)
+                if result_containing['returncode']:
+                    return result_containing
+                containing = result_containing['output']
+            in_tags = any(name.startswith('refs/tags/') for name in containing)
+
             # for each remote name check if the hash is part of the remote
             for remote in remotes:
-                # get all remote names
-                cmd_refs = [
-                    GitClient._executable,
-                    'rev-list',
-                    '--remotes=' + remote,
-                    '--tags',
-                ]
-                result_refs = self._run_command(cmd_refs)
-                if result_refs['returncode']:
-                    result_refs['output'] = (
-                        "Could not determine refs of remote '%s': " % remote
-                        + result_refs['output']
-                    )
-                    return result_refs
-                refs = result_refs['output'].splitlines()
-                if ref not in refs:
+                prefix = 'refs/remotes/%s/' % remote
+                if not in_tags and not any(
+                    name.startswith(prefix) for name in containing
+                ):
                     continue
 
-                cmds = [result_ref['cmd']]
                 if command.with_tags:
                     # check if there is exactly one tag pointing to that ref
-                    cmd_tags = [GitClient._executable, 'tag', '--points-at', ref]
-                    result_tags = self._run_command(cmd_tags)
-                    if result_tags['returncode']:
-                        result_tags['output'] = (
-                            "Could not determine tags for ref '%s': " % ref
-                            + result_tags['output']
-                        )
-                        return result_tags
-                    cmds.append(result_tags['cmd'])
-                    tags = result_tags['output'].splitlines()
+                    result_refs = session.get_refs()
+                    if result_refs['returncode']:
+                        return result_refs
+                    tags = [
+                        r['name'][len('refs/tags/') :]
+                        for r in result_refs['output']
+                        if r['name'].startswith('refs/tags/')
+                        and ref in (r['hash'], r['peeled'])
+                    ]
                     if len(tags) == 1:
                         tag = tags[0]
                         # double check that the tag is part of the remote
@@ -200,6 +283,7 @@ class GitClient(VcsClientBase):
                                 + result_ls_remote['output']
                             )
                             return result_ls_remote
+                        session.cmds.append(result_ls_remote['cmd'])
                         matches = self._get_hash_ref_tuples(result_ls_remote['output'])
                         for match_hash, _ in matches:
                             if match_hash == ref:
@@ -207,15 +291,14 @@ class GitClient(VcsClientBase):
                                 break
 
                 # determine url of remote
-                result_url = self._get_remote_url(remote)
+                result_url = self._get_remote_url(remote, session)
                 if result_url['returncode']:
                     return result_url
                 url = result_url['output']
-                cmds.append(result_url['cmd'])
 
                 # the result is the remote url and the hash/tag
                 return {
-                    'cmd': ' && '.join(cmds),
+                    'cmd': ' && '.join(session.cmds),
                     'cwd': self.path,
                     'output': '\n'.join([url, ref]),
                     'returncode': 0,
@@ -223,20 +306,25 @@ class GitClient(VcsClientBase):
                 }
 
             return {
-                'cmd': ' && '.join([result_ref['cmd'], result_remotes['cmd']]),
+                'cmd': ' && '.join(session.cmds),
                 'cwd': self.path,
                 'output': "Could not determine remote containing '%s'" % ref,
                 'returncode': 1,
             }
 
-    def _get_remote_url(self, remote):
-        cmd_url = [GitClient._executable, 'config', '--get', 'remote.%s.url' % remote]
-        result_url = self._run_command(cmd_url)
-        if result_url['returncode']:
-            result_url['output'] = (
-                'Could not determine remote url: ' + result_url['output']
-            )
-        return result_url
+    def _get_remote_url(self, remote, session):
+        result_remotes = session.get_remotes()
+        if result_remotes['returncode']:
+            return result_remotes
+        url = dict(result_remotes['output']).get(remote)
+        return {
+            'cmd': ' && '.join(session.cmds),
+            'cwd': self.path,
+            'output': url
+            if url is not None
+            else "Could not determine remote url: no url for remote '%s'" % remote,
+            'returncode': 0 if url is not None else 1,
+        }
 
     def import_(self, command):
         if not command.url:
@@ -431,6 +519,17 @@ class GitClient(VcsClientBase):
                     checkout_version = command.version
                 if command.shallow:
                     cmd_clone += ['--depth', '1']
+                result_mirror = None
+                if (
+                    command.cache_dir
+                    and not command.shallow
+                    and not command.blobless_clone
+                ):
+                    result_mirror, mirror_path = self._update_mirror(command)
+                    if mirror_path is not None:
+                        cmd_clone += ['--reference', mirror_path]
+                        if command.dissociate:
+                            cmd_clone.append('--dissociate')
                 result_clone = self._run_command(cmd_clone, retry=command.retry)
                 if result_clone['returncode']:
                     result_clone['output'] = "Could not clone repository '%s': %s" % (
@@ -440,6 +539,11 @@ class GitClient(VcsClientBase):
                     return result_clone
                 cmd = result_clone['cmd']
                 output = result_clone['output']
+                if result_mirror is not None:
+                    if result_mirror['cmd']:
+                        cmd = result_mirror['cmd'] + ' && ' + cmd
+                    if result_mirror['output']:
+                        output = '\n'.join([result_mirror['output'], output])
             else:
                 # getting a hash or tag with a depth of 1 can't use 'clone'
                 cmd_init = [GitClient._executable, 'init']
@@ -515,23 +619,139 @@ class GitClient(VcsClientBase):
 
         return {'cmd': cmd, 'cwd': self.path, 'output': output, 'returncode': 0}
 
+    def _update_mirror(self, command):
+        """
+        Create or update the bare mirror of the repository in the cache.
+
+        The mirror is locked while it is being updated since other jobs and
+        invocations might use the same cache directory.
+        It is only updated once per process.
+
+        :returns: a tuple of the result and the path of the mirror, the path
+          is None if the mirror can't be used
+        """
+        if fcntl is None:
+            return None, None
+        mirror_path = get_mirror_path(command.cache_dir, command.url)
+        try:
+            os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+            lock_file = open(mirror_path + '.lock', 'a')
+        except OSError as e:
+            return {
+                'cmd': '',
+                'cwd': self.path,
+                'output': "Could not lock mirror '%s', cloning without it: %s"
+                % (mirror_path, e),
+                'returncode': 1,
+            }, None
+        # the lock is released when the file is closed
+        with lock_file:
+            if not _lock_file(lock_file):
+                return {
+                    'cmd': '',
+                    'cwd': self.path,
+                    'output': "Stopped waiting for the lock of mirror '%s' since "
+                    'the job has been cancelled' % mirror_path,
+                    'returncode': 1,
+                }, None
+            if mirror_path in _updated_mirrors:
+                return None, mirror_path
+            if os.path.isdir(mirror_path):
+                result = self._fetch_mirror(command, mirror_path)
+            else:
+                result = self._clone_mirror(command, mirror_path)
+            if result['returncode']:
+                result['output'] = (
+                    "Could not update mirror '%s', cloning without it: %s"
+                    % (mirror_path, result['output'])
+                )
+                return result, None
+            _updated_mirrors.add(mirror_path)
+        return result, mirror_path
+
+    def _fetch_mirror(self, command, mirror_path):
+        cmd_fetch = [
+            GitClient._executable,
+            '--git-dir=' + mirror_path,
+            'fetch',
+            '--prune',
+            '--quiet',
+            'origin',
+        ]
+        return self._run_command(cmd_fetch, retry=command.retry)
+
+    def _clone_mirror(self, command, mirror_path):
+        # an interrupted clone mustn't leave an incomplete mirror behind
+        temp_path = mirror_path + '.tmp'
+        if os.path.exists(temp_path):
+            rmtree(temp_path)
+        cmd_clone = [
+            GitClient._executable,
+            'clone',
+            '--mirror',
+            '--quiet',
+            command.url,
+            temp_path,
+        ]
+        result = self._run_command(cmd_clone, retry=command.retry)
+        if result['returncode']:
+            return result
+        # the clones reference the objects of the mirror, even the ones of
+        # refs which have been removed from the remote repository
+        cmd_config = [
+            GitClient._executable,
+            '--git-dir=' + temp_path,
+            'config',
+            'gc.pruneExpire',
+            'never',
+        ]
+        result_config = self._run_command(cmd_config)
+        if result_config['returncode']:
+            return result_config
+        try:
+            os.replace(temp_path, mirror_path)
+        except OSError as e:
+            return {
+                'cmd': 'os.replace(%s, %s)' % (temp_path, mirror_path),
+                'cwd': self.path,
+                'output': str(e),
+                'returncode': 1,
+            }
+        result['cmd'] += ' && ' + result_config['cmd']
+        return result
+
+    def read_remote_url(self):
+        # parse the config file instead of invoking 'git config'
+        config_path = os.path.join(self.path, '.git', 'config')
+        urls = {}
+        remote = None
+        try:
+            with open(config_path, 'r', encoding='utf-8') as h:
+                for line in h:
+                    line = line.strip()
+                    if line.startswith('['):
+                        match = re.match(r'\[remote\s+"(.+)"\]', line)
+                        remote = match.group(1) if match else None
+                    elif remote is not None and '=' in line:
+                        key, value = line.split('=', 1)
+                        if key.strip().lower() == 'url':
+                            urls.setdefault(remote, value.strip().strip('"'))
+        except (OSError, UnicodeDecodeError):
+            return None
+        if 'origin' in urls:
+            return urls['origin']
+        return urls[sorted(urls)[0]] if urls else None
+
     def _get_remote_urls(self):
-        cmd_remote = [GitClient._executable, 'remote', 'show']
-        result_remote = self._run_command(cmd_remote)
-        if result_remote['returncode']:
-            result_remote['output'] = (
-                'Could not determine remotes: ' + result_remote['output']
-            )
-            return result_remote
-        remote_urls = []
-        cmd = result_remote['cmd']
-        for remote in result_remote['output'].splitlines():
-            result_url = self._get_remote_url(remote)
-            cmd += ' && ' + result_url['cmd']
-            if not result_url['returncode']:
-                remote_urls.append((result_url['output'], remote))
+        with GitQuerySession(self) as session:
+            result_remotes = session.get_remotes()
+        if result_remotes['returncode']:
+            return result_remotes
+        remote_urls = [
+            (url, remote) for remote, url in result_remotes['output'] if url is not None
+        ]
         return {
-            'cmd': cmd,
+            'cmd': ' && '.join(session.cmds),
             'cwd': self.path,
             'output': (
                 remote_urls
@@ -625,7 +845,7 @@ class GitClient(VcsClientBase):
         if not command.verbose:
             cmd += ['--pretty=short']
         self._check_color(cmd)
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def pull(self, _command):
         self._check_executable()
@@ -668,18 +888,14 @@ class GitClient(VcsClientBase):
     def status(self, command):
         self._check_executable()
         while command.hide_empty:
-            # check if ahead
-            cmd = [GitClient._executable, 'log', '@{push}..']
-            result = self._run_command(cmd)
-            if not result['returncode'] and result['output']:
-                # ahead, do not hide
-                break
-            # check if behind
-            cmd = [GitClient._executable, 'log', '..@{upstream}']
-            result = self._run_command(cmd)
-            if not result['returncode'] and result['output']:
-                # behind, do not hide
-                break
+            # check if ahead of the push destination or behind the upstream
+            with GitQuerySession(self) as session:
+                result = session.get_head_tracking()
+            if not result['returncode'] and result['output'] is not None:
+                upstream_track, push_track = result['output']
+                if 'ahead' in push_track or 'behind' in upstream_track:
+                    # do not hide
+                    break
             cmd = [GitClient._executable, 'status', '-s']
             if command.quiet:
                 cmd += ['--untracked-files=no']
@@ -691,7 +907,7 @@ class GitClient(VcsClientBase):
         self._check_color(cmd)
         if command.quiet:
             cmd += ['--untracked-files=no']
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def validate(self, command):
         if not command.url:
@@ -816,5 +1032,330 @@ class GitClient(VcsClientBase):
         return tuples
 
 
+class GitQuerySession(object):
+    """
+    Answer ref, remote and object queries of a repository with few processes.
+
+    All refs are listed by a single ``git for-each-ref`` and all remotes by a
+    single ``git config --get-regexp``, both are kept for the lifetime of the
+    session.
+    Revisions are resolved through a long-lived ``git cat-file --batch-check``
+    process which is started on first use and stopped when the session is
+    closed.
+
+    If the job uses a metadata cache the successful results of the queries
+    are persisted and answered from the cache as long as the signature of the
+    repository (see :func:`get_metadata_signature`) doesn't change.
+
+    The query methods return a result dictionary like ``_run_command`` with
+    the parsed data as ``output`` on success.
+    The command lines of all invoked processes are collected in ``cmds``.
+    """
+
+    REF_FORMAT = '%00'.join(
+        ['%(refname)', '%(objectname)', '%(*objectname)', '%(HEAD)', '%(upstream)']
+    )
+
+    def __init__(self, client):
+        self._client = client
+        self._refs = None
+        self._remotes = None
+        self._batch = None
+        self.cmds = []
+
+        # the cached query results, None if not cached
+        self._metadata = None
+        self._metadata_updated = False
+        state = get_current_job_state()
+        self._metadata_cache = state.metadata_cache if state is not None else None
+        if self._metadata_cache is not None:
+            self._signature = get_metadata_signature(client.path)
+            if self._signature is not None:
+                self._repository = os.path.realpath(client.path)
+                self._metadata = (
+                    self._metadata_cache.get(self._repository, self._signature) or {}
+                )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run_command(self, cmd):
+        result = self._client._run_command(cmd)
+        self.cmds.append(result['cmd'])
+        return result
+
+    def _query(self, key, query):
+        # answer the query from the metadata cache if possible
+        if self._metadata is not None and key in self._metadata:
+            cmd, output = self._metadata[key]
+            if cmd not in self.cmds:
+                self.cmds.append(cmd)
+            return {
+                'cmd': cmd,
+                'cwd': self._client.path,
+                'output': output,
+                'returncode': 0,
+            }
+        result = query()
+        if self._metadata is not None and not result['returncode']:
+            self._metadata[key] = (result['cmd'], result['output'])
+            self._metadata_updated = True
+        return result
+
+    def get_refs(self):
+        """
+        Get all branches, remote branches and tags.
+
+        Each ref is a dictionary with the full ``name``, the ``hash``, the
+        ``peeled`` hash of annotated tags, whether it is the checked out
+        ``head`` branch and the full name of its ``upstream`` branch.
+        """
+        if self._refs is None:
+            result = self._query('refs', self._list_refs)
+            if not result['returncode']:
+                self._refs = result
+            return result
+        return self._refs
+
+    def _list_refs(self):
+        cmd = [
+            GitClient._executable,
+            'for-each-ref',
+            '--format=' + self.REF_FORMAT,
+            'refs/heads',
+            'refs/remotes',
+            'refs/tags',
+        ]
+        result = self._run_command(cmd)
+        if result['returncode']:
+            result['output'] = 'Could not determine refs: ' + result['output']
+            return result
+        refs = []
+        for line in result['output'].splitlines():
+            name, hash_, peeled, head, upstream = line.split('\0')
+            refs.append(
+                {
+                    'name': name,
+                    'hash': hash_,
+                    'peeled': peeled or None,
+                    'head': head == '*',
+                    'upstream': upstream or None,
+                }
+            )
+        result['output'] = refs
+        return result
+
+    def get_head_branch(self):
+        """Get the ref of the checked out branch, None if HEAD is detached."""
+        result = self.get_refs()
+        if not result['returncode']:
+            result = dict(result)
+            result['output'] = next(
+                (ref for ref in result['output'] if ref['head']), None
+            )
+        return result
+
+    def get_head_hash(self):
+        return self._query('head_hash', self._get_head_hash)
+
+    def _get_head_hash(self):
+        result = self.get_head_branch()
+        if result['returncode']:
+            return result
+        result = dict(result)
+        if result['output'] is not None:
+            result['output'] = result['output']['hash']
+            return result
+        hash_ = self.resolve('HEAD')
+        if hash_ is None:
+            result['output'] = 'Could not determine ref: HEAD is not a valid revision'
+            result['returncode'] = 1
+        else:
+            result['output'] = hash_
+        return result
+
+    def get_head_tracking(self):
+        """
+        Get the tracking information of the checked out branch.
+
+        The output is a tuple of the ahead / behind information relative to
+        the upstream branch and the push destination (e.g. '[ahead 1]'), None
+        if HEAD is detached.
+        """
+        return self._query('head_tracking', self._get_head_tracking)
+
+    def _get_head_tracking(self):
+        cmd = [
+            GitClient._executable,
+            'for-each-ref',
+            '--points-at',
+            'HEAD',
+            '--format=%(HEAD)%00%(upstream:track)%00%(push:track)',
+            'refs/heads',
+        ]
+        result = self._run_command(cmd)
+        if not result['returncode']:
+            tracking = None
+            for line in result['output'].splitlines():
+                head, upstream_track, push_track = line.split('\0')
+                if head == '*':
+                    tracking = (upstream_track, push_track)
+            result['output'] = tracking
+        return result
+
+    def get_refs_containing(self, hash_):
+        """Get the names of remote branches and tags containing the commit."""
+        return self._query(
+            'refs_containing ' + hash_, lambda: self._get_refs_containing(hash_)
+        )
+
+    def _get_refs_containing(self, hash_):
+        cmd = [
+            GitClient._executable,
+            'for-each-ref',
+            '--contains',
+            hash_,
+            '--format=%(refname)',
+            'refs/remotes',
+            'refs/tags',
+        ]
+        result = self._run_command(cmd)
+        if result['returncode']:
+            result['output'] = (
+                "Could not determine refs containing '%s': " % hash_ + result['output']
+            )
+        else:
+            result['output'] = result['output'].splitlines()
+        return result
+
+    def get_remotes(self):
+        """Get a list of (remote name, url) tuples, the url might be None."""
+        if self._remotes is None:
+            result = self._query('remotes', self._list_remotes)
+            if not result['returncode']:
+                self._remotes = result
+            return result
+        return self._remotes
+
+    def _list_remotes(self):
+        cmd = [GitClient._executable, 'config', '-z', '--get-regexp', r'^remote\.']
+        result = self._run_command(cmd)
+        # the return code 1 indicates that no remote is configured
+        if result['returncode'] not in (0, 1):
+            result['output'] = 'Could not determine remotes: ' + result['output']
+            return result
+        urls = {}
+        for entry in result['output'].split('\0'):
+            key, _, value = entry.partition('\n')
+            name, _, variable = key[len('remote.') :].rpartition('.')
+            if not name:
+                continue
+            urls.setdefault(name, None)
+            if variable == 'url':
+                # like 'git config --get' the last value wins
+                urls[name] = value
+        result['output'] = sorted(urls.items())
+        result['returncode'] = 0
+        return result
+
+    def resolve(self, revision):
+        """Get the hash of the object the revision refers to or None."""
+        if self._batch is None and not self._start_batch():
+            return None
+        with tracing.span('git cat-file', 'subprocess', revision=revision):
+            try:
+                self._batch.stdin.write(revision.encode('utf8') + b'\n')
+                self._batch.stdin.flush()
+                line = self._batch.stdout.readline()
+                self._batch_output_bytes += len(line)
+                line = line.decode('utf8')
+            except OSError:
+                # e.g. the process has been killed since the job was cancelled
+                return None
+        # '<hash> <type> <size>' or '<revision> missing'
+        parts = line.split()
+        return parts[0] if len(parts) == 3 else None
+
+    def _start_batch(self):
+        state = get_current_job_state()
+        if state is not None and state.cancelled is not None:
+            return False
+        cmd = [GitClient._executable, 'cat-file', '--batch-check']
+        self._batch_start = time.monotonic()
+        self._batch_output_bytes = 0
+        self._batch = subprocess.Popen(
+            cmd,
+            cwd=os.path.abspath(self._client.path),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            **_get_session_kwargs(state),
+        )
+        if state is not None:
+            state.add_process(self._batch)
+        self.cmds.append(' '.join(cmd))
+        return True
+
+    def close(self):
+        if self._metadata_updated:
+            self._metadata_updated = False
+            self._metadata_cache.set(self._repository, self._signature, self._metadata)
+        if self._batch is None:
+            return
+        batch, self._batch = self._batch, None
+        try:
+            batch.stdin.close()
+        except OSError:
+            pass
+        batch.stdout.close()
+        batch.wait()
+        state = get_current_job_state()
+        if state is not None:
+            state.remove_process(batch)
+        stats.add_process(
+            get_command_name(batch.args),
+            state.path if state is not None else self._client.path,
+            time.monotonic() - self._batch_start,
+            self._batch_output_bytes,
+        )
+
+
+def get_metadata_signature(path):
+    """
+    Get a signature of the refs, HEAD and the configuration of a repository.
+
+    The signature contains the stat information of the files storing them
+    and of all directories containing loose refs, which change whenever a
+    loose ref is added, updated or removed.
+    The working tree and the index aren't covered.
+
+    :returns: a list of stat information, None if the repository uses a
+      different layout (e.g. a worktree or the reftable format) or if any of
+      the files has been modified too recently to reliably detect further
+      modifications
+    """
+    git_dir = os.path.join(path, '.git')
+    if not os.path.isdir(git_dir) or os.path.exists(os.path.join(git_dir, 'reftable')):
+        return None
+    names = ['HEAD', 'config', 'packed-refs']
+    for dirpath, _, _ in os.walk(os.path.join(git_dir, 'refs')):
+        names.append(os.path.relpath(dirpath, git_dir))
+    signature = []
+    now = time.time()
+    for name in sorted(names):
+        try:
+            st = os.stat(os.path.join(git_dir, name))
+        except FileNotFoundError:
+            signature.append([name, None])
+            continue
+        if now - st.st_mtime < RACY_INTERVAL:
+            return None
+        signature.append([name, st.st_mtime_ns, st.st_size, st.st_ino])
+    return signature
+
+
 if not GitClient._executable:
     GitClient._executable = which('git')
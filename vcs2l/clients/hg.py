@@ -1,4 +1,6 @@
 import os
+from configparser import Error as ConfigParserError
+from configparser import RawConfigParser
 from shutil import which
 from threading import Lock
 
@@ -9,7 +11,10 @@ from vcs2l.util import rmtree
 
 class HgClient(VcsClientBase):
     type = 'hg'
+    marker = '.hg'
     _executable = None
+    network_subcommands = frozenset(['clone', 'incoming', 'outgoing', 'pull', 'push'])
+    read_only_subcommands = frozenset(['id', 'identify', 'paths'])
     _config_color = None
     _config_color_lock = Lock()
 
@@ -29,7 +34,7 @@ class HgClient(VcsClientBase):
     def custom(self, command):
         self._check_executable()
         cmd = [HgClient._executable] + command.args
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def diff(self, command):
         self._check_executable()
@@ -37,7 +42,7 @@ class HgClient(VcsClientBase):
         self._check_color(cmd)
         if command.context:
             cmd += ['--unified %d' % command.context]
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def export(self, command):
         self._check_executable()
@@ -90,6 +95,15 @@ class HgClient(VcsClientBase):
             return result_url
         return result_url
 
+    def read_remote_url(self):
+        # parse the repository config instead of invoking 'hg paths'
+        config = RawConfigParser()
+        try:
+            config.read(os.path.join(self.path, '.hg', 'hgrc'), encoding='utf-8')
+            return config.get('paths', 'default')
+        except (ConfigParserError, UnicodeDecodeError):
+            return None
+
     def import_(self, command):
         if not command.url or not command.version:
             if not command.url and not command.version:
@@ -231,7 +245,7 @@ class HgClient(VcsClientBase):
         if command.verbose:
             cmd += ['--verbose']
         self._check_color(cmd)
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def pull(self, _command):
         self._check_executable()
@@ -255,7 +269,7 @@ class HgClient(VcsClientBase):
         self._check_color(cmd)
         if command.quiet:
             cmd += ['--untracked-files=no']
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def validate(self, command):
         if not command.url:
@@ -7,7 +7,12 @@ from vcs2l.clients.vcs_base import VcsClientBase
 
 class SvnClient(VcsClientBase):
     type = 'svn'
+    marker = '.svn'
     _executable = None
+    network_subcommands = frozenset(
+        ['checkout', 'co', 'export', 'list', 'log', 'ls', 'switch', 'up', 'update']
+    )
+    read_only_subcommands = frozenset(['info'])
 
     @staticmethod
     def is_repository(path):
@@ -63,14 +68,14 @@ class SvnClient(VcsClientBase):
     def custom(self, command):
         self._check_executable()
         cmd = [SvnClient._executable] + command.args
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def diff(self, command):
         self._check_executable()
         cmd = [SvnClient._executable, 'diff']
         if command.context:
             cmd += ['--unified=%d' % command.context]
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def export(self, command):
         self._check_executable()
@@ -165,7 +170,7 @@ class SvnClient(VcsClientBase):
         cmd = [SvnClient._executable, 'log']
         if command.limit != 0:
             cmd += ['--limit', '%d' % command.limit]
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def pull(self, _command):
         self._check_executable()
@@ -209,7 +214,7 @@ class SvnClient(VcsClientBase):
         cmd = [SvnClient._executable, 'status']
         if command.quiet:
             cmd += ['--quiet']
-        return self._run_command(cmd)
+        return self._run_command(cmd, spool=True)
 
     def validate(self, command):
         if not command.url:
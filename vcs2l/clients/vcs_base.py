@@ -1,16 +1,36 @@
+import io
 import os
 import socket
 import subprocess
 import sys
+import tempfile
 import time
+from contextlib import contextmanager
 from urllib.error import HTTPError, URLError
 from urllib.request import Request, urlopen
 
-from vcs2l.executor import ansi
+import vcs2l.query_cache as query_cache
+import vcs2l.stats as stats
+import vcs2l.tracing as tracing
+from vcs2l.executor import (
+    LOCAL,
+    NETWORK,
+    LineStream,
+    ansi,
+    get_current_job,
+    get_current_job_state,
+)
+from vcs2l.scheduler import get_retry_delay
 
 
 class VcsClientBase(object):
     type = None
+    # the name of the metadata directory identifying a repository
+    marker = None
+    # subcommands which contact a remote repository
+    network_subcommands = frozenset()
+    # subcommands which only query the repository, their results are memoized
+    read_only_subcommands = frozenset()
 
     def __init__(self, path):
         self.path = path
@@ -36,7 +56,33 @@ class VcsClientBase(object):
             'returncode': NotImplemented,
         }
 
-    def _run_command(self, cmd, env=None, retry=0):
+    def _run_command(self, cmd, env=None, retry=0, spool=False):
+        cache = query_cache.cache
+        if cache is None:
+            return self._run_command_with_retries(
+                cmd, env=env, retry=retry, spool=spool
+            )
+        repository = os.path.realpath(self.path)
+        if not self._is_read_only(cmd):
+            # the command might change the results of read-only commands
+            cache.invalidate(repository)
+            try:
+                return self._run_command_with_retries(
+                    cmd, env=env, retry=retry, spool=spool
+                )
+            finally:
+                cache.invalidate(repository)
+        key = (tuple(cmd), frozenset(env.items()) if env is not None else None)
+        result, generation = cache.get(repository, key)
+        if result is not None:
+            tracing.instant('cached', 'cache', argv=cmd)
+            return result
+        result = self._run_command_with_retries(cmd, env=env, retry=retry, spool=spool)
+        if not result['returncode']:
+            cache.add(repository, key, result, generation)
+        return result
+
+    def _run_command_with_retries(self, cmd, env=None, retry=0, spool=False):
         for i in range(retry + 1):
             if i > 0:
                 print(
@@ -45,17 +91,44 @@ class VcsClientBase(object):
                     + ansi('reset'),
                     file=sys.stderr,
                 )
-            result = run_command(cmd, os.path.abspath(self.path), env=env)
+                _count_retry()
+                tracing.instant('retry', 'retry', cmd=cmd, attempt=i)
+            with acquire_resource(self._get_resource_class(cmd)):
+                result = run_command(
+                    cmd, os.path.abspath(self.path), env=env, spool=spool
+                )
             if not result['returncode']:
                 # return successful result
                 break
-            if i >= retry:
+            if i >= retry or _is_cancelled():
                 # return the failure after retries
                 break
-            # increasing sleep before each retry
-            time.sleep(i + 1)
+            # increasing delay before each retry
+            _wait_for_retry(get_retry_delay(i + 1))
+            if _is_cancelled():
+                break
         return result
 
+    def _is_read_only(self, cmd):
+        """Check if the command neither changes the repository nor its state."""
+        subcommand = get_command_name(cmd).partition(' ')[2]
+        return subcommand in self.read_only_subcommands
+
+    def _get_resource_class(self, cmd):
+        """Get the resource class of the command, either network or local."""
+        subcommand = get_command_name(cmd).partition(' ')[2]
+        if subcommand in self.network_subcommands:
+            return NETWORK
+        # e.g. querying information about a remote repository
+        if any('://' in arg for arg in cmd[1:]):
+            return NETWORK
+        return LOCAL
+
+    def read_remote_url(self):
+        # the URL of the default remote determined from the repository
+        # metadata without invoking the vcs client, None if unknown
+        return None
+
     def _create_path(self):
         if not os.path.exists(self.path):
             try:
@@ -70,16 +143,187 @@ class VcsClientBase(object):
         return None
 
 
-def run_command(cmd, cwd, env=None):
+@contextmanager
+def acquire_resource(resource):
+    """Wait until the limit of the resource class allows another command."""
+    state = get_current_job_state()
+    if state is None or state.resources is None:
+        yield
+        return
+    with state.resources.acquire(resource):
+        yield
+
+
+def _count_retry():
+    # count the retries of the current job as a sign of congestion
+    job = get_current_job()
+    if job is not None:
+        job['retries'] = job.get('retries', 0) + 1
+
+
+def _is_cancelled():
+    state = get_current_job_state()
+    return state is not None and state.cancelled is not None
+
+
+def _wait_for_retry(delay):
+    with tracing.span('backoff', 'sleep', seconds=delay):
+        state = get_current_job_state()
+        if state is None:
+            # not invoked by the executor
+            time.sleep(delay)
+        elif state.cancelled is None:
+            # the worker runs other jobs in the meantime
+            state.wait_for_retry(get_current_job(), delay)
+
+
+def get_command_name(cmd):
+    """Get the executable name and the subcommand, e.g. 'git fetch'."""
+    name = [os.path.basename(cmd[0])]
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg == '-c':
+            # skip configuration options like '-c color.ui=always'
+            next(args, None)
+        elif not arg.startswith('-'):
+            name.append(arg)
+            break
+    return ' '.join(name)
+
+
+# number of bytes read from the output of a subprocess at once
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputBuffer(object):
+    """
+    Collect the output of a subprocess.
+
+    If the output exceeds the optional limit (in bytes) only the beginning
+    and the end are kept and the omitted part is replaced by a marker.
+    With a spool (see :class:`vcs2l.executor.OutputSpool`) the beginning is
+    spilled to a temporary file while it is being written once it exceeds
+    the threshold of the spool.
+    Such an output is moved to the spool instead of being decoded.
+    """
+
+    def __init__(self, limit=None, spool=None):
+        self.limit = limit
+        self._spool = spool
+        if spool is not None:
+            self._head = tempfile.SpooledTemporaryFile(
+                max_size=spool.threshold, prefix='vcs2l-'
+            )
+        else:
+            self._head = io.BytesIO()
+        self._head_size = 0
+        self._tail = bytearray()
+        self._truncated = 0
+        # the number of bytes written including the omitted ones
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None:
+            head_room = max(self.limit // 2 - self._head_size, 0)
+            self._tail += data[head_room:]
+            data = data[:head_room]
+            excess = len(self._tail) - (self.limit - self.limit // 2)
+            if excess > 0:
+                del self._tail[:excess]
+                self._truncated += excess
+        if data:
+            self._head.write(data)
+            self._head_size += len(data)
+
+    def getvalue(self):
+        if not self._truncated:
+            self._head.write(self._tail)
+            self._head_size += len(self._tail)
+            _rstrip_file(self._head, self._head_size)
+            tail = b''
+        else:
+            tail = (
+                '\n[... %d bytes of output truncated ...]\n' % self._truncated
+            ).encode('utf8') + self._tail.rstrip()
+        if self._spool is not None and self._head_size > self._spool.threshold:
+            self._head.seek(0, os.SEEK_END)
+            self._head.write(tail)
+            return self._spool.add_file(self._head)
+        with self._head:
+            self._head.seek(0)
+            head = self._head.read()
+        if not self._truncated:
+            return head.decode('utf8')
+        # the cuts might split multi-byte characters
+        return (head + tail).decode('utf8', 'replace')
+
+
+def _rstrip_file(f, size):
+    # remove trailing whitespace like bytes.rstrip() without reading it all
+    while size:
+        start = max(0, size - CHUNK_SIZE)
+        f.seek(start)
+        chunk = f.read(size - start).rstrip()
+        size = start + len(chunk)
+        if chunk:
+            break
+    f.truncate(size)
+
+
+def run_command(cmd, cwd, env=None, spool=False):
+    """
+    Run the command and return its result.
+
+    :param spool: if the output exceeds the spool threshold of the running
+      job it is returned as a :class:`vcs2l.executor.SpooledOutput` instead
+      of a string, only for outputs which aren't processed any further
+    """
+    with tracing.span(get_command_name(cmd), 'subprocess', argv=cmd) as trace_args:
+        result = _run_process(cmd, cwd, env=env, spool=spool)
+        trace_args['returncode'] = result['returncode']
+    return result
+
+
+def _run_process(cmd, cwd, env=None, spool=False):
+    state = get_current_job_state()
     if not os.path.exists(cwd):
         cwd = None
     result = {'cmd': ' '.join(cmd), 'cwd': cwd}
+    if state is not None and state.cancelled is not None:
+        return _get_cancelled_result(result)
     try:
+        start = time.monotonic()
         proc = subprocess.Popen(
-            cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            **_get_session_kwargs(state),
         )
-        output, _ = proc.communicate()
-        result['output'] = output.rstrip().decode('utf8')
+        if state is not None:
+            state.add_process(proc)
+        output = OutputBuffer(
+            _get_max_output(state),
+            spool=state.spool if spool and state is not None else None,
+        )
+        stream = _get_line_stream(state)
+        try:
+            with proc.stdout:
+                # read1() returns as soon as any output is available
+                for chunk in iter(lambda: proc.stdout.read1(CHUNK_SIZE), b''):
+                    output.write(chunk)
+                    if stream is not None:
+                        stream.write(chunk)
+            proc.wait()
+        finally:
+            if stream is not None:
+                stream.close()
+            if state is not None:
+                state.remove_process(proc)
+        _add_process_stats(cmd, cwd, state, start, output)
+        result['output'] = output.getvalue()
         result['returncode'] = proc.returncode
     except subprocess.CalledProcessError as e:
         result['output'] = e.output.decode('utf8')
@@ -87,46 +331,80 @@ def run_command(cmd, cwd, env=None):
     return result
 
 
+def _get_max_output(job_state):
+    return job_state.max_output if job_state is not None else None
+
+
+def _add_process_stats(cmd, cwd, job_state, start, output):
+    stats.add_process(
+        get_command_name(cmd),
+        job_state.path if job_state is not None else cwd,
+        time.monotonic() - start,
+        output.size,
+    )
+
+
+def _get_line_stream(job_state):
+    if job_state is None or not job_state.stream:
+        return None
+    return LineStream(job_state.path)
+
+
+def _get_session_kwargs(job_state):
+    if job_state is not None and job_state.isolate_processes:
+        if sys.platform != 'win32':
+            # make the process the leader of a new process group
+            return {'start_new_session': True}
+    return {}
+
+
+def _get_cancelled_result(result):
+    result['output'] = 'Command not started since the job has been cancelled'
+    result['returncode'] = 1
+    return result
+
+
 def load_url(url, retry=2, retry_period=1, timeout=10):
-    try:
-        fh = urlopen(url, timeout=timeout)
-    except HTTPError as e:
-        if e.code == 503 and retry:
-            time.sleep(retry_period)
-            return load_url(
-                url, retry=retry - 1, retry_period=retry_period, timeout=timeout
-            )
-        e.msg += ' (%s)' % url
-        raise
-    except URLError as e:
-        if isinstance(e.reason, socket.timeout) and retry:
-            time.sleep(retry_period)
-            return load_url(
-                url, retry=retry - 1, retry_period=retry_period, timeout=timeout
-            )
-        raise URLError(str(e) + ' (%s)' % url)
-    return fh.read()
+    for attempt in range(1, retry + 2):
+        try:
+            with acquire_resource(NETWORK):
+                fh = urlopen(url, timeout=timeout)
+                return fh.read()
+        except HTTPError as e:
+            if e.code == 503 and attempt <= retry:
+                _wait_for_url_retry(attempt, retry_period)
+                continue
+            e.msg += ' (%s)' % url
+            raise
+        except URLError as e:
+            if isinstance(e.reason, socket.timeout) and attempt <= retry:
+                _wait_for_url_retry(attempt, retry_period)
+                continue
+            raise URLError(str(e) + ' (%s)' % url)
 
 
 def test_url(url, retry=2, retry_period=1, timeout=10):
     request = Request(url)
     request.get_method = lambda: 'HEAD'
 
-    try:
-        response = urlopen(request)
-    except HTTPError as e:
-        if e.code == 503 and retry:
-            time.sleep(retry_period)
-            return test_url(
-                url, retry=retry - 1, retry_period=retry_period, timeout=timeout
-            )
-        e.msg += ' (%s)' % url
-        raise
-    except URLError as e:
-        if isinstance(e.reason, socket.timeout) and retry:
-            time.sleep(retry_period)
-            return test_url(
-                url, retry=retry - 1, retry_period=retry_period, timeout=timeout
-            )
-        raise URLError(str(e) + ' (%s)' % url)
-    return response
+    for attempt in range(1, retry + 2):
+        try:
+            with acquire_resource(NETWORK):
+                return urlopen(request)
+        except HTTPError as e:
+            if e.code == 503 and attempt <= retry:
+                _wait_for_url_retry(attempt, retry_period)
+                continue
+            e.msg += ' (%s)' % url
+            raise
+        except URLError as e:
+            if isinstance(e.reason, socket.timeout) and attempt <= retry:
+                _wait_for_url_retry(attempt, retry_period)
+                continue
+            raise URLError(str(e) + ' (%s)' % url)
+
+
+def _wait_for_url_retry(attempt, retry_period):
+    # increasing delay before each retry
+    _count_retry()
+    _wait_for_retry(get_retry_delay(attempt, base=retry_period))
@@ -10,6 +10,7 @@ from .push import PushCommand
 from .remotes import RemotesCommand
 from .status import StatusCommand
 from .validate import ValidateCommand
+from .watch import WatchCommand
 
 vcs2l_commands = []
 vcs2l_commands.append(BranchCommand)
@@ -24,6 +25,7 @@ vcs2l_commands.append(PushCommand)
 vcs2l_commands.append(RemotesCommand)
 vcs2l_commands.append(StatusCommand)
 vcs2l_commands.append(ValidateCommand)
+vcs2l_commands.append(WatchCommand)
 
 _commands = [c.command for c in vcs2l_commands]
 if len(_commands) != len(set(_commands)):
@@ -2,22 +2,33 @@ import argparse
 import os
 from multiprocessing import cpu_count
 
-from vcs2l.crawler import find_repositories
+from vcs2l.crawler import iter_repositories
 from vcs2l.executor import (
+    LOCAL,
+    NETWORK,
+    OrderedResultWriter,
     execute_jobs,
-    generate_jobs,
+    iter_jobs,
+    output_json_result,
     output_repositories,
-    output_results,
+    output_result,
 )
+from vcs2l.history import JobHistory
+from vcs2l.metadata import MetadataCache
+from vcs2l.watcher import query_watcher
 
 
 class Command(object):
     command = None
+    # the command contacts the remote repositories, e.g. to fetch
+    network = False
 
     def __init__(self, args):
         self.debug = args.debug if 'debug' in args else False
         self.hide_empty = args.hide_empty if 'hide_empty' in args else False
         self.nested = args.nested if 'nested' in args else False
+        self.use_index = args.index if 'index' in args else False
+        self.max_depth = args.max_depth if 'max_depth' in args else None
         self.output_repos = args.repos if 'repos' in args else False
         if 'paths' in args:
             self.paths = args.paths
@@ -25,6 +36,10 @@ class Command(object):
             self.paths = [args.path]
 
 
+# upper bound of the number of parallel jobs when using '--workers auto'
+ADAPTIVE_MAX_WORKERS = 64
+
+
 def check_greater_zero(value):
     try:
         value = int(value)
@@ -35,8 +50,37 @@ def check_greater_zero(value):
     return value
 
 
+def check_greater_zero_float(value):
+    try:
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid float value: '%s'" % value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("invalid positive float value: '%s'" % value)
+    return value
+
+
+def workers_type(value):
+    if value == 'auto':
+        return value
+    return check_greater_zero(value)
+
+
+def host_limit(value):
+    host, sep, limit = value.rpartition('=')
+    if not sep or not host:
+        raise argparse.ArgumentTypeError("invalid host limit: '%s'" % value)
+    return host, check_greater_zero(limit)
+
+
 def add_common_arguments(
-    parser, skip_hide_empty=False, skip_nested=False, path_nargs='*', path_help=None
+    parser,
+    skip_hide_empty=False,
+    skip_nested=False,
+    skip_unordered=False,
+    path_nargs='*',
+    path_help=None,
+    host_limits=False,
 ):
     parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
     group = parser.add_argument_group('Common parameters')
@@ -60,6 +104,20 @@ def add_common_arguments(
             default=False,
             help='Search for nested repositories',
         )
+        group.add_argument(
+            '--index',
+            action='store_true',
+            default=False,
+            help="Store the found repositories in '.vcs2l/index.json' in each "
+            'base path and reuse them as long as no directory changed',
+        )
+        group.add_argument(
+            '--max-depth',
+            type=check_greater_zero,
+            metavar='N',
+            help='Only search for repositories up to N levels of subdirectories '
+            'below each path',
+        )
     try:
         default_workers = cpu_count()
     except NotImplementedError:
@@ -67,11 +125,127 @@ def add_common_arguments(
     group.add_argument(
         '-w',
         '--workers',
-        type=check_greater_zero,
+        type=workers_type,
         metavar='N',
         default=default_workers,
-        help='Number of parallel worker threads',
+        help="Number of parallel worker threads, 'auto' adapts the number at "
+        'runtime based on the throughput',
+    )
+    if host_limits:
+        group.add_argument(
+            '--max-jobs-per-host',
+            type=check_greater_zero,
+            metavar='N',
+            help='Maximum number of parallel jobs contacting the same network host',
+        )
+        group.add_argument(
+            '--host-limit',
+            type=host_limit,
+            action='append',
+            default=[],
+            metavar='HOST=N',
+            help='Maximum number of parallel jobs contacting a specific network '
+            'host, can be passed multiple times',
+        )
+    group.add_argument(
+        '--network-jobs',
+        type=check_greater_zero,
+        metavar='N',
+        help='Maximum number of parallel commands contacting a remote '
+        'repository (clone, fetch, pull, push, ...)',
+    )
+    group.add_argument(
+        '--local-jobs',
+        type=check_greater_zero,
+        metavar='N',
+        help='Maximum number of parallel commands only accessing the local '
+        'repository (status, checkout, ...)',
+    )
+    group.add_argument(
+        '--schedule-by-history',
+        action='store_true',
+        default=False,
+        help='Record the duration of each job in the user cache directory and '
+        'start the jobs which took longest in previous runs first',
+    )
+    group.add_argument(
+        '--metadata-cache',
+        action='store_true',
+        default=False,
+        help='Cache the refs and remotes of git repositories in the user cache '
+        'directory and answer queries of unchanged repositories from it',
+    )
+    group.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='Write the timing of all jobs and invoked commands to FILE in '
+        'the Chrome trace event format',
+    )
+    group.add_argument(
+        '--job-timeout',
+        type=check_greater_zero_float,
+        metavar='SECONDS',
+        help='Kill the commands of a job which takes longer and report it as '
+        'timed out (the commands are started in a new session and therefore '
+        'cannot prompt for credentials)',
     )
+    group.add_argument(
+        '--total-timeout',
+        type=check_greater_zero_float,
+        metavar='SECONDS',
+        help='Kill the commands of all jobs which are still running after '
+        'this time and skip the remaining jobs',
+    )
+    group.add_argument(
+        '--fail-fast',
+        action='store_true',
+        default=False,
+        help='Stop starting further jobs after the first job failed',
+    )
+    group.add_argument(
+        '--fail-fast-cancel',
+        action='store_true',
+        default=False,
+        help='Like --fail-fast but also kill the commands of all running jobs '
+        '(the commands are started in a new session and therefore cannot '
+        'prompt for credentials)',
+    )
+    group.add_argument(
+        '--max-output',
+        type=check_greater_zero,
+        metavar='BYTES',
+        help='Only keep the beginning and the end of the output of each '
+        'command exceeding this size',
+    )
+    group.add_argument(
+        '--stream',
+        action='store_true',
+        default=False,
+        help='Output the lines of the commands to stderr as they arrive, '
+        'prefixed with the repository path (the results are output as usual)',
+    )
+    group.add_argument(
+        '--stats',
+        action='store_true',
+        default=False,
+        help='Output statistics about the spawned processes to stderr, e.g. '
+        'their number per subcommand and the CPU time they used',
+    )
+    group.add_argument(
+        '--format',
+        choices=['jsonl', 'text'],
+        default='text',
+        help="Output format, 'jsonl' outputs one JSON object per repository as "
+        'soon as its job finished',
+    )
+    if not skip_unordered:
+        group.add_argument(
+            '--unordered',
+            action='store_true',
+            default=False,
+            help='Output the results in the order the jobs finish instead of '
+            'alphabetically',
+        )
     group.add_argument(
         '--repos',
         action='store_true',
@@ -98,6 +272,68 @@ def add_common_arguments(
         )
 
 
+def get_execute_jobs_kwargs(args):
+    """Get the keyword arguments for execute_jobs() from the common arguments."""
+    adaptive = args.workers == 'auto'
+    return {
+        'number_of_workers': ADAPTIVE_MAX_WORKERS if adaptive else args.workers,
+        'adaptive': adaptive,
+        'debug_jobs': args.debug,
+        'host_limits': dict(args.host_limit) if 'host_limit' in args else None,
+        'default_host_limit': args.max_jobs_per_host
+        if 'max_jobs_per_host' in args
+        else None,
+        'history': JobHistory() if args.schedule_by_history else None,
+        'trace_file': args.trace,
+        'job_timeout': args.job_timeout,
+        'total_timeout': args.total_timeout,
+        'fail_fast': args.fail_fast or args.fail_fast_cancel,
+        'fail_fast_cancel': args.fail_fast_cancel,
+        'max_output': args.max_output,
+        'stream': args.stream,
+        'show_stats': args.stats,
+        'metadata_cache': MetadataCache() if args.metadata_cache else None,
+        'resource_limits': {
+            NETWORK: args.network_jobs,
+            LOCAL: args.local_jobs,
+        },
+    }
+
+
+def get_result_writer(jobs, args, output_handler=output_result):
+    """
+    Get a callback for execute_jobs() to output each result when ready.
+
+    If the jobs are None the paths are passed to the ordered output by
+    :meth:`OrderedResultWriter.track`, see :func:`get_job_stream`.
+    """
+    hide_empty = args.hide_empty if 'hide_empty' in args else False
+    if args.format == 'jsonl':
+        return lambda result: output_json_result(result, hide_empty=hide_empty)
+    if args.unordered:
+        return lambda result: output_handler(result, hide_empty=hide_empty)
+    return OrderedResultWriter(
+        [job['client'].path for job in jobs] if jobs is not None else None,
+        output_handler=output_handler,
+        hide_empty=hide_empty,
+    )
+
+
+def get_job_stream(clients, command, args):
+    """
+    Get the jobs for the clients and a callback to output each result.
+
+    The jobs are generated while iterating the clients, so execute_jobs()
+    starts them while the remaining repositories are still being found.
+    The ordered output starts once all jobs have been generated.
+    """
+    jobs = iter_jobs(clients, command)
+    result_writer = get_result_writer(None, args)
+    if isinstance(result_writer, OrderedResultWriter):
+        jobs = result_writer.track(jobs)
+    return jobs, result_writer
+
+
 def existing_dir(path):
     if not os.path.exists(path):
         raise argparse.ArgumentTypeError("Path '%s' does not exist." % path)
@@ -106,20 +342,51 @@ def existing_dir(path):
     return path
 
 
+def can_query_watcher(args):
+    """
+    Check if the results may be answered by a watcher, see :mod:`vcs2l.watcher`.
+
+    The watcher can't apply the options changing how the jobs are executed.
+    """
+    return not (
+        args.stats
+        or args.trace
+        or args.stream
+        or args.max_output
+        or args.fail_fast
+        or args.fail_fast_cancel
+        or args.job_timeout
+        or args.total_timeout
+    )
+
+
 def simple_main(parser, command_class, args=None):
-    add_common_arguments(parser)
+    add_common_arguments(parser, host_limits=command_class.network)
     args = parser.parse_args(args)
 
     command = command_class(args)
-    clients = find_repositories(command.paths, nested=command.nested)
+    results = query_watcher(command) if can_query_watcher(args) else None
+    if results is not None:
+        if command.output_repos:
+            output_repositories([result['client'] for result in results])
+        result_writer = get_result_writer(results, args)
+        for result in results:
+            result_writer(result)
+        return 1 if any(r['returncode'] for r in results) else 0
+
+    clients = iter_repositories(
+        command.paths,
+        nested=command.nested,
+        use_index=command.use_index,
+        max_depth=command.max_depth,
+    )
     if command.output_repos:
+        clients = list(clients)
         output_repositories(clients)
-    jobs = generate_jobs(clients, command)
+    jobs, result_writer = get_job_stream(clients, command, args)
     results = execute_jobs(
-        jobs, show_progress=True, number_of_workers=args.workers, debug_jobs=args.debug
+        jobs, result_callback=result_writer, **get_execute_jobs_kwargs(args)
     )
 
-    output_results(results, hide_empty=args.hide_empty)
-
     any_error = any(r['returncode'] for r in results)
     return 1 if any_error else 0
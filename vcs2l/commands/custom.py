@@ -2,13 +2,16 @@ import argparse
 import sys
 
 from vcs2l.clients import vcs2l_clients
-from vcs2l.commands.command import Command, add_common_arguments
-from vcs2l.crawler import find_repositories
+from vcs2l.commands.command import (
+    Command,
+    add_common_arguments,
+    get_execute_jobs_kwargs,
+    get_job_stream,
+)
+from vcs2l.crawler import iter_repositories
 from vcs2l.executor import (
     execute_jobs,
-    generate_jobs,
     output_repositories,
-    output_results,
 )
 from vcs2l.streams import set_streams
 
@@ -82,18 +85,22 @@ def main(args=None, stdout=None, stderr=None):
     command = CustomCommand(args)
 
     # filter repositories by specified client types
-    clients = find_repositories(command.paths, nested=command.nested)
-    clients = [c for c in clients if c.type in args and args.__dict__[c.type]]
+    clients = iter_repositories(
+        command.paths,
+        nested=command.nested,
+        use_index=command.use_index,
+        max_depth=command.max_depth,
+    )
+    clients = (c for c in clients if c.type in args and args.__dict__[c.type])
 
     if command.output_repos:
+        clients = list(clients)
         output_repositories(clients)
-    jobs = generate_jobs(clients, command)
+    jobs, result_writer = get_job_stream(clients, command, args)
     results = execute_jobs(
-        jobs, show_progress=True, number_of_workers=args.workers, debug_jobs=args.debug
+        jobs, result_callback=result_writer, **get_execute_jobs_kwargs(args)
     )
 
-    output_results(results, hide_empty=args.hide_empty)
-
     any_error = any(r['returncode'] for r in results)
     return 1 if any_error else 0
 
@@ -2,12 +2,17 @@ import argparse
 import os
 import sys
 
-from vcs2l.commands.command import Command, add_common_arguments
-from vcs2l.crawler import find_repositories
+from vcs2l.commands.command import (
+    Command,
+    add_common_arguments,
+    get_execute_jobs_kwargs,
+    get_job_stream,
+)
+from vcs2l.crawler import iter_repositories
 from vcs2l.executor import (
     ansi,
     execute_jobs,
-    generate_jobs,
+    iter_jobs,
     output_repositories,
     output_results,
 )
@@ -106,15 +111,29 @@ def main(args=None, stdout=None, stderr=None):
     set_streams(stdout=stdout, stderr=stderr)
 
     parser = get_parser()
-    add_common_arguments(parser, skip_hide_empty=True, path_nargs='?')
+    add_common_arguments(
+        parser, skip_hide_empty=True, skip_unordered=True, path_nargs='?'
+    )
     args = parser.parse_args(args)
 
     command = ExportCommand(args)
-    clients = find_repositories(command.paths, nested=command.nested)
+    clients = iter_repositories(
+        command.paths,
+        nested=command.nested,
+        use_index=command.use_index,
+        max_depth=command.max_depth,
+    )
     if command.output_repos:
+        clients = list(clients)
         output_repositories(clients)
-    jobs = generate_jobs(clients, command)
-    results = execute_jobs(jobs, number_of_workers=args.workers)
+    if args.format == 'jsonl':
+        jobs, result_writer = get_job_stream(clients, command, args)
+        results = execute_jobs(
+            jobs, result_callback=result_writer, **get_execute_jobs_kwargs(args)
+        )
+        return 1 if any(r['returncode'] for r in results) else 0
+
+    results = execute_jobs(iter_jobs(clients, command), **get_execute_jobs_kwargs(args))
 
     # check if at least one repo was found in the client directory
     basename = None
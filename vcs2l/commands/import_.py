@@ -10,14 +10,20 @@ from vcs2l import __version__ as vcs2l_version
 from vcs2l.clients import vcs2l_clients
 from vcs2l.clients.none import NoneClient
 from vcs2l.clients.vcs_base import run_command
-from vcs2l.commands.command import Command, add_common_arguments
+from vcs2l.commands.command import (
+    Command,
+    add_common_arguments,
+    get_execute_jobs_kwargs,
+    get_result_writer,
+)
 from vcs2l.errors import CircularImportError
-from vcs2l.executor import ansi, execute_jobs, output_repositories, output_results
+from vcs2l.executor import ansi, execute_jobs, output_repositories
 from vcs2l.streams import set_streams
 
 
 class ImportCommand(Command):
     command = 'import'
+    network = True
     help = 'Import the list of repositories'
 
     def __init__(
@@ -35,6 +41,8 @@ class ImportCommand(Command):
         self.force = args.force
         self.retry = args.retry
         self.skip_existing = args.skip_existing
+        self.cache_dir = args.cache_dir
+        self.dissociate = args.dissociate
         self.recursive = recursive
         self.shallow = shallow
         self.blobless_clone = blobless_clone
@@ -85,6 +93,21 @@ def get_parser():
         default=2,
         help='Retry commands requiring network access N times on failure',
     )
+    group.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        default=os.environ.get('VCS2L_CACHE_DIR') or None,
+        help='Keep a bare mirror of each cloned git repository in DIR and '
+        'only fetch new objects into it, new clones reference its objects '
+        '(default: $VCS2L_CACHE_DIR)',
+    )
+    group.add_argument(
+        '--dissociate',
+        action='store_true',
+        default=False,
+        help='Copy the referenced objects from the mirrors into the clones, '
+        'so they keep working if the cache directory is removed',
+    )
     group.add_argument(
         '--skip-existing',
         action='store_true',
@@ -326,8 +349,11 @@ def main(args=None, stdout=None, stderr=None):
         skip_nested=True,
         path_nargs='?',
         path_help='Base path to clone repositories to',
+        host_limits=True,
     )
     args = parser.parse_args(args)
+    if args.dissociate and not args.cache_dir:
+        parser.error('--dissociate requires --cache-dir')
     try:
         input_ = args.input
         if isinstance(input_, request.Request):
@@ -343,10 +369,10 @@ def main(args=None, stdout=None, stderr=None):
     if args.repos:
         output_repositories([job['client'] for job in jobs])
 
-    workers = args.workers
+    kwargs = get_execute_jobs_kwargs(args)
     # for ssh URLs check if the host is known to prevent ssh asking for
     # confirmation when using more than one worker
-    if workers > 1:
+    if kwargs['number_of_workers'] > 1:
         ssh_keygen = None
         checked_hosts = set()
         for job in list(jobs):
@@ -376,13 +402,12 @@ def main(args=None, stdout=None, stderr=None):
                     'single worker to allow interactively answering the ssh '
                     'question to confirm the fingerprint' % host
                 )
-                workers = 1
+                kwargs['number_of_workers'] = 1
                 break
 
     results = execute_jobs(
-        jobs, show_progress=True, number_of_workers=workers, debug_jobs=args.debug
+        jobs, result_callback=get_result_writer(jobs, args), **kwargs
     )
-    output_results(results)
 
     any_error = any(r['returncode'] for r in results)
     return 1 if any_error else 0
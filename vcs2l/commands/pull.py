@@ -7,6 +7,7 @@ from vcs2l.streams import set_streams
 
 class PullCommand(Command):
     command = 'pull'
+    network = True
     help = 'Bring changes from the repository into the working copy'
 
     def __init__(self, args):
@@ -7,6 +7,7 @@ from vcs2l.streams import set_streams
 
 class PushCommand(Command):
     command = 'push'
+    network = True
     help = 'Push changes from the working copy to the repository'
 
     def __init__(self, args):
@@ -3,14 +3,20 @@ import sys
 
 from vcs2l.clients import vcs2l_clients
 from vcs2l.clients.none import NoneClient
-from vcs2l.commands.command import Command, add_common_arguments
+from vcs2l.commands.command import (
+    Command,
+    add_common_arguments,
+    get_execute_jobs_kwargs,
+    get_result_writer,
+)
 from vcs2l.commands.import_ import get_repositories
-from vcs2l.executor import ansi, execute_jobs, output_results
+from vcs2l.executor import ansi, execute_jobs
 from vcs2l.streams import set_streams
 
 
 class ValidateCommand(Command):
     command = 'validate'
+    network = True
     help = 'Validate the repository list file'
 
     def __init__(self, args, url, version=None):
@@ -65,7 +71,7 @@ def main(args=None, stdout=None, stderr=None):
     set_streams(stdout=stdout, stderr=stderr)
 
     parser = get_parser()
-    add_common_arguments(parser, skip_nested=True, path_nargs=False)
+    add_common_arguments(parser, skip_nested=True, path_nargs=False, host_limits=True)
     args = parser.parse_args(args)
     try:
         repos = get_repositories(args.input)
@@ -76,11 +82,11 @@ def main(args=None, stdout=None, stderr=None):
     jobs = generate_jobs(repos, args)
 
     results = execute_jobs(
-        jobs, show_progress=True, number_of_workers=args.workers, debug_jobs=args.debug
+        jobs,
+        result_callback=get_result_writer(jobs, args),
+        **get_execute_jobs_kwargs(args),
     )
 
-    output_results(results, hide_empty=args.hide_empty)
-
     any_error = any(r['returncode'] for r in results)
     return 1 if any_error else 0
 
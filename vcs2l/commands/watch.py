@@ -0,0 +1,96 @@
+import argparse
+import os
+import signal
+import sys
+
+from vcs2l.commands.branch import BranchCommand
+from vcs2l.commands.command import (
+    Command,
+    check_greater_zero,
+    existing_dir,
+)
+from vcs2l.commands.status import StatusCommand
+from vcs2l.executor import ansi
+from vcs2l.streams import set_streams
+from vcs2l.watcher import WorkspaceWatcher
+
+
+class WatchCommand(Command):
+    command = 'watch'
+    help = 'Watch the repositories to answer "status" and "branch" faster'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Watch the repositories for changes and answer the queries of '
+        '"vcs status" and "vcs branch" for the same path. Only the results of '
+        'repositories which changed since the last query are computed again.',
+        prog='vcs watch',
+    )
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+    group = parser.add_argument_group('"watch" command parameters')
+    group.add_argument(
+        '--debug', action='store_true', default=False, help='Show debug messages'
+    )
+    group.add_argument(
+        '-n',
+        '--nested',
+        action='store_true',
+        default=False,
+        help='Search for nested repositories',
+    )
+    group.add_argument(
+        '--max-depth',
+        type=check_greater_zero,
+        metavar='N',
+        help='Only search for repositories up to N levels of subdirectories '
+        'below the path',
+    )
+    group.add_argument(
+        '-w',
+        '--workers',
+        type=check_greater_zero,
+        metavar='N',
+        default=10,
+        help='Number of parallel jobs computing the results',
+    )
+    group.add_argument(
+        'path',
+        nargs='?',
+        type=existing_dir,
+        default=os.curdir,
+        help='Base path to look for repositories',
+    )
+    return parser
+
+
+def main(args=None, stdout=None, stderr=None):
+    set_streams(stdout=stdout, stderr=stderr)
+    parser = get_parser()
+    args = parser.parse_args(args)
+
+    watcher = WorkspaceWatcher(
+        args.path,
+        {
+            BranchCommand.command: BranchCommand,
+            StatusCommand.command: StatusCommand,
+        },
+        nested=args.nested,
+        max_depth=args.max_depth,
+        number_of_workers=args.workers,
+    )
+    print("Watching the repositories in '%s'" % args.path, file=sys.stderr)
+    # remove the socket when being terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        watcher.serve_forever()
+    except (OSError, RuntimeError) as e:
+        print(ansi('redf') + str(e) + ansi('reset'), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
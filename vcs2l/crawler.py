@@ -1,37 +1,381 @@
+import json
 import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
+from vcs2l.util import RACY_INTERVAL
 
 from . import vcs2l_clients
 
+# the number of threads listing directories concurrently
+CRAWLER_THREADS = 8
+# the maximum number of directories listed ahead of the traversal
+MAX_PENDING = 10000
+# the directory in a base path containing the workspace index, never crawled
+INDEX_DIRECTORY = '.vcs2l'
+INDEX_VERSION = 2
+# the file containing glob patterns of subdirectories which aren't crawled
+IGNORE_FILE = '.vcs2lignore'
+# the directories which are never crawled, e.g. the metadata of repositories
+SKIPPED_DIRECTORIES = {INDEX_DIRECTORY} | {
+    client_class.marker for client_class in vcs2l_clients if client_class.marker
+}
 
-def find_repositories(paths, nested=False):
-    repos = []
-    visited = []
-    for path in paths:
-        _find_repositories(path, repos, visited, nested=nested)
-    return repos
 
+def find_repositories(paths, nested=False, use_index=False, max_depth=None):
+    """
+    Find the repositories in the paths and their subdirectories.
+
+    The directories are listed concurrently while the repositories are
+    returned in the order of a depth-first traversal visiting the
+    subdirectories alphabetically.
+    The metadata directories of repositories are never crawled, as well as
+    the subdirectories matching a pattern of an ignore file (see
+    :data:`IGNORE_FILE`) in the directory or any of its parents.
 
-def _find_repositories(path, repos, visited, nested=False):
-    abs_path = os.path.abspath(path)
-    if abs_path in visited:
+    :param use_index: use the index stored in each base path if it is still
+      valid, otherwise crawl the base path and store the index
+    :param max_depth: the maximum depth of subdirectories below each path
+      which are crawled, None to crawl all subdirectories
+    """
+    return list(
+        iter_repositories(
+            paths, nested=nested, use_index=use_index, max_depth=max_depth
+        )
+    )
+
+
+def iter_repositories(paths, nested=False, use_index=False, max_depth=None):
+    """
+    Generate the repositories like :func:`find_repositories` once found.
+
+    Each repository is generated as soon as the traversal reaches it, so
+    the caller can use it while the remaining directories are crawled.
+    """
+    if use_index:
+        yield from _iter_indexed_repositories(paths, nested, max_depth)
         return
-    visited.append(abs_path)
+    # the absolute paths of the visited base paths, since they might overlap
+    visited = set()
+    roots = {os.path.abspath(path) for path in paths}
+    with ThreadPoolExecutor(max_workers=CRAWLER_THREADS) as pool:
+        crawler = _Crawler(pool, roots, nested, max_depth)
+        for path in paths:
+            yield from _collect_repositories(crawler, path, None, visited)
 
-    client = get_vcs_client(path)
+
+def _collect_repositories(
+    crawler, path, future, visited, depth=0, rules=(), stamps=None
+):
+    if future is None:
+        abs_path = os.path.abspath(path)
+        if abs_path in visited:
+            return
+        visited.add(abs_path)
+        future = crawler.submit(path, depth, rules)
+
+    client, subdirectories, path_stamps = crawler.get_result(future)
     if client:
-        repos.append(client)
-        if not nested:
+        yield client
+    if stamps is not None:
+        stamps.extend(path_stamps)
+    for subpath, subfuture, subdepth, subrules in subdirectories:
+        yield from _collect_repositories(
+            crawler, subpath, subfuture, visited, subdepth, subrules, stamps
+        )
+
+
+class _Crawler(object):
+    """
+    List directories ahead of the traversal using a thread pool.
+
+    When a directory has been listed its subdirectories are submitted to be
+    listed as well unless too many listed directories haven't been consumed
+    by the traversal yet.
+    Each directory is listed with its depth below the base path and the
+    ignore rules of its parents.
+    """
+
+    def __init__(self, pool, roots, nested, max_depth=None):
+        self._pool = pool
+        self._roots = roots
+        self._nested = nested
+        self._max_depth = max_depth
+        self._lock = threading.Lock()
+        # the number of submitted directories which haven't been consumed
+        self._pending = 0
+
+    def submit(self, path, depth=0, rules=()):
+        with self._lock:
+            self._pending += 1
+        return self._pool.submit(self._scan, path, depth, rules)
+
+    def _submit_ahead(self, path, depth, rules):
+        with self._lock:
+            if self._pending >= MAX_PENDING:
+                return None
+            self._pending += 1
+        return self._pool.submit(self._scan, path, depth, rules)
+
+    def get_result(self, future):
+        """
+        Get the client and the subdirectories of a listed directory.
+
+        Additionally the modification times of the listed directory and of
+        its ignore file are returned to validate the index.
+        """
+        result = future.result()
+        with self._lock:
+            self._pending -= 1
+        return result
+
+    def _scan(self, path, depth, rules):
+        # the modification time before the directory is listed, so later
+        # modifications are detected when validating the index
+        stamps = []
+        try:
+            stamps.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            pass
+        names = []
+        has_ignore_file = False
+        try:
+            with os.scandir(path) as entries:
+                # the file type is known from the listing except for symlinks
+                for entry in entries:
+                    if entry.name == IGNORE_FILE:
+                        has_ignore_file = entry.is_file()
+                    elif entry.is_dir():
+                        names.append(entry.name)
+        except OSError:
+            names = None
+
+        client = _get_vcs_client(path, names)
+        if client and not self._nested:
+            # the subdirectories don't matter, only that it is a repository
+            return client, [], []
+        if names is None:
+            return client, [], stamps
+        if self._max_depth is not None and depth >= self._max_depth:
+            return client, [], stamps
+
+        if has_ignore_file:
+            ignore_path = os.path.join(path, IGNORE_FILE)
+            try:
+                stamps.append((ignore_path, os.stat(ignore_path).st_mtime_ns))
+            except OSError:
+                pass
+            rules = rules + _read_ignore_file(path)
+
+        subdirectories = []
+        for name in sorted(names):
+            if name in SKIPPED_DIRECTORIES:
+                continue
+            subpath = os.path.join(path, name)
+            if _is_ignored(subpath, name, rules):
+                continue
+            if os.path.abspath(subpath) in self._roots:
+                # let the traversal check if it has been visited before,
+                # another base path is crawled like any base path
+                subdirectories.append((subpath, None, 0, ()))
+                continue
+            future = self._submit_ahead(subpath, depth + 1, rules)
+            subdirectories.append((subpath, future, depth + 1, rules))
+        return client, subdirectories, stamps
+
+
+def _read_ignore_file(path):
+    """
+    Read the ignore rules of a directory.
+
+    Each line of the ignore file contains a glob pattern.
+    Empty lines and lines starting with ``#`` are skipped.
+    A pattern without a slash (except a trailing one) matches the name of a
+    subdirectory at any depth, otherwise it matches the path relative to
+    the directory containing the ignore file.
+
+    :returns: a tuple of (directory, pattern, is relative path) tuples
+    """
+    try:
+        with open(os.path.join(path, IGNORE_FILE), 'r', encoding='utf-8') as h:
+            lines = h.read().splitlines()
+    except (OSError, ValueError):
+        return ()
+    rules = []
+    for line in lines:
+        pattern = line.strip()
+        if not pattern or pattern.startswith('#'):
+            continue
+        pattern = pattern.rstrip('/')
+        is_relative_path = '/' in pattern
+        rules.append((path, pattern.lstrip('/'), is_relative_path))
+    return tuple(rules)
+
+
+def _is_ignored(path, name, rules):
+    for directory, pattern, is_relative_path in rules:
+        if is_relative_path:
+            relpath = os.path.relpath(path, directory).replace(os.sep, '/')
+            if fnmatch(relpath, pattern):
+                return True
+        elif fnmatch(name, pattern):
+            return True
+    return False
+
+
+def _iter_indexed_repositories(paths, nested, max_depth):
+    # overlapping base paths contain the same repositories
+    found = set()
+    for path in paths:
+        for client in _iter_indexed_repositories_of_path(path, nested, max_depth):
+            abs_path = os.path.abspath(client.path)
+            if abs_path not in found:
+                found.add(abs_path)
+                yield client
+
+
+def _iter_indexed_repositories_of_path(path, nested, max_depth):
+    index_path = os.path.join(path, INDEX_DIRECTORY, 'index.json')
+    index = _read_index(index_path)
+    if (
+        index is not None
+        and index['nested'] == nested
+        and index['max_depth'] == max_depth
+    ):
+        repos = _get_valid_repositories(path, index)
+        if repos is not None:
+            yield from repos
             return
 
     try:
-        listdir = os.listdir(path)
+        _create_index_directory(path)
     except OSError:
-        listdir = []
-    for name in sorted(listdir):
-        subpath = os.path.join(path, name)
-        if not os.path.isdir(subpath):
-            continue
-        _find_repositories(subpath, repos, visited, nested=nested)
+        index_path = None
+    repos = []
+    stamps = []
+    for client in crawl_base_path(path, nested, max_depth, stamps):
+        repos.append(client)
+        yield client
+    if index_path is not None:
+        _write_index(index_path, path, nested, max_depth, repos, stamps)
+
+
+def _create_index_directory(path):
+    """
+    Create the index directory in a base path unless it exists.
+
+    Creating the directory modifies the base path right before it is
+    listed, its previous modification time is restored since the index
+    wouldn't be written while the base path was modified recently.
+    """
+    index_directory = os.path.join(path, INDEX_DIRECTORY)
+    if os.path.isdir(index_directory):
+        return
+    st = os.stat(path)
+    os.mkdir(index_directory)
+    try:
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    except OSError:
+        # e.g. the base path is owned by another user
+        pass
+
+
+def crawl_base_path(path, nested, max_depth, stamps):
+    """
+    Generate the repositories in a single base path.
+
+    The modification times of the listed directories and of the read
+    ignore files are appended to the list of stamps.
+    """
+    with ThreadPoolExecutor(max_workers=CRAWLER_THREADS) as pool:
+        crawler = _Crawler(pool, {os.path.abspath(path)}, nested, max_depth)
+        yield from _collect_repositories(crawler, path, None, set(), stamps=stamps)
+
+
+def _read_index(index_path):
+    try:
+        with open(index_path, 'r', encoding='utf-8') as h:
+            index = json.load(h)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def _get_valid_repositories(path, index):
+    """
+    Get the repositories of the index if it is still valid, otherwise None.
+
+    A new or removed subdirectory changes the modification time of the
+    directory containing it, therefore the modification times of all listed
+    directories and of the read ignore files are compared.
+    The directories of repositories which weren't listed are checked to
+    still be repositories of the same type.
+    """
+    for parts, mtime in index['mtimes']:
+        try:
+            if os.stat(os.path.join(path, *parts)).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+    repos = []
+    for parts, client_type in index['repositories']:
+        client = get_vcs_client(os.path.join(path, *parts) if parts else path)
+        if client is None or client.__class__.type != client_type:
+            return None
+        repos.append(client)
+    return repos
+
+
+def _write_index(index_path, path, nested, max_depth, repos, stamps):
+    now = time.time()
+    if any(now - mtime / 1e9 < RACY_INTERVAL for _, mtime in stamps):
+        # further modifications might not change the modification time
+        return
+    index = {
+        'version': INDEX_VERSION,
+        'nested': nested,
+        'max_depth': max_depth,
+        'mtimes': [[split_path(p, path), mtime] for p, mtime in stamps],
+        'repositories': [
+            [split_path(client.path, path), client.__class__.type] for client in repos
+        ],
+    }
+    # replace the index atomically since other invocations might read it
+    try:
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(index_path), prefix='index-'
+        )
+    except OSError:
+        return
+    try:
+        with open(fd, 'w', encoding='utf-8') as h:
+            json.dump(index, h)
+        os.replace(temp_path, index_path)
+    except OSError:
+        os.remove(temp_path)
+
+
+def split_path(path, base_path):
+    """Get the components of a path relative to the base path."""
+    relpath = os.path.relpath(path, base_path)
+    return [] if relpath == os.curdir else relpath.split(os.sep)
+
+
+def _get_vcs_client(path, names):
+    # identify the repository by the subdirectories if they are known
+    for client_class in vcs2l_clients:
+        marker = client_class.marker
+        if marker is not None and names is not None:
+            if marker in names:
+                return client_class(path)
+        elif client_class.is_repository(path):
+            return client_class(path)
+    return None
 
 
 def get_vcs_client(path):
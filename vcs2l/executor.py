@@ -1,11 +1,27 @@
+import json
 import logging
 import os
+import shutil
+import signal
+import subprocess
 import sys
+import tempfile
 import threading
+import time
 import traceback
+import weakref
+from contextlib import contextmanager
 from queue import Empty, Queue
 
+import vcs2l.query_cache as query_cache
+import vcs2l.stats as stats
 import vcs2l.streams as streams
+import vcs2l.tracing as tracing
+from vcs2l.scheduler import (
+    AdaptiveConcurrency,
+    JobScheduler,
+    get_critical_path_durations,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig()
@@ -31,7 +47,11 @@ def output_repositories(clients):
 
 
 def generate_jobs(clients, command):
-    jobs = []
+    return list(iter_jobs(clients, command))
+
+
+def iter_jobs(clients, command):
+    """Generate the jobs like :func:`generate_jobs` while iterating the clients."""
     realpaths = {}
     for client in clients:
         # check if client is a duplicate of another path
@@ -50,9 +70,7 @@ def generate_jobs(clients, command):
                     client, method_name, DuplicateCommandHandler(client, duplicate_path)
                 )
 
-        job = {'client': client, 'command': command}
-        jobs.append(job)
-    return jobs
+        yield {'client': client, 'command': command}
 
 
 class DuplicateCommandHandler(object):
@@ -69,15 +87,173 @@ class DuplicateCommandHandler(object):
         }
 
 
-def get_ready_job(jobs):
-    for job in jobs:
-        if not job.get('depends', set()):
-            jobs.remove(job)
-            return job
-    return None
+# resource classes of the commands invoked by the jobs
+NETWORK = 'network'
+LOCAL = 'local'
+
+
+class ResourceLimits(object):
+    """
+    Limit the number of concurrent commands per resource class.
+
+    The commands of all jobs contacting a remote host share the limit of the
+    network resource class while commands only accessing the local
+    repository share the one of the local resource class.
+    A job therefore only waits for the resource needed by its current step,
+    e.g. a local checkout isn't queued behind slow clones.
+    """
+
+    def __init__(self, limits=None):
+        self._semaphores = {
+            resource: threading.BoundedSemaphore(limit)
+            for resource, limit in (limits or {}).items()
+            if limit
+        }
+
+    @contextmanager
+    def acquire(self, resource):
+        semaphore = self._semaphores.get(resource)
+        if semaphore is None:
+            yield
+            return
+        if not semaphore.acquire(blocking=False):
+            with tracing.span('wait for %s' % resource, 'resource'):
+                semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+# the number of bytes of an output above which it is spooled to disk
+SPOOL_THRESHOLD = 64 * 1024
+
+
+class OutputSpool(object):
+    """
+    Store large outputs of results in a single temporary file.
+
+    Keeping the outputs of all results in memory until they are printed
+    could otherwise require a lot of memory.
+    The outputs of commands are spilled to a temporary file of their own
+    while they are being read (see :class:`vcs2l.clients.vcs_base.OutputBuffer`)
+    and moved into the spool afterwards, so only a single file stays open.
+    The file is closed once no spooled output refers to the spool anymore.
+    """
+
+    def __init__(self, threshold=SPOOL_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._file = None
 
+    def add(self, output):
+        data = output.encode('utf8')
+        with self._lock:
+            offset = self._append(lambda f: f.write(data))
+        return SpooledOutput(self, offset, len(data))
 
-def execute_jobs(jobs, show_progress=False, number_of_workers=10, debug_jobs=False):
+    def add_file(self, file):
+        """Move the content of a file into the spool and close the file."""
+        try:
+            file.seek(0)
+            with self._lock:
+                offset = self._append(lambda f: shutil.copyfileobj(file, f))
+                length = self._file.tell() - offset
+        finally:
+            file.close()
+        return SpooledOutput(self, offset, length)
+
+    def _append(self, write):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='vcs2l-')
+            weakref.finalize(self, self._file.close)
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        write(self._file)
+        return offset
+
+    def read(self, offset, length):
+        with self._lock:
+            self._file.seek(offset)
+            # the cuts of truncated outputs might split multi-byte characters
+            return self._file.read(length).decode('utf8', 'replace')
+
+
+class SpooledOutput(object):
+    """The output of a result which is read from the spool when needed."""
+
+    def __init__(self, spool, offset, length):
+        self._spool = spool
+        self._offset = offset
+        self._length = length
+
+    def __str__(self):
+        return self._spool.read(self._offset, self._length)
+
+    def __bool__(self):
+        return self._length > 0
+
+
+class LineStream(object):
+    """
+    Output the lines of a subprocess as they arrive, prefixed with a path.
+
+    The lines are written to stderr, so they don't interfere with the
+    results written to stdout.
+    An incomplete line is kept until it has been completed or the subprocess
+    finished.
+    """
+
+    # the lines of concurrently running jobs must not be interleaved
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        self._prefix = ansi('bluef') + fix_output_path(path) + ansi('reset') + ': '
+        self._partial = b''
+
+    def write(self, data):
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        self._output(lines)
+
+    def close(self):
+        if self._partial:
+            self._output([self._partial])
+            self._partial = b''
+
+    def _output(self, lines):
+        if not lines:
+            return
+        text = ''.join(
+            self._prefix + line.rstrip(b'\r').decode('utf8', 'replace') + '\n'
+            for line in lines
+        )
+        with self._lock:
+            streams.stderr.write(text)
+            streams.stderr.flush()
+
+
+def execute_jobs(
+    jobs,
+    number_of_workers=10,
+    debug_jobs=False,
+    host_limits=None,
+    default_host_limit=None,
+    adaptive=False,
+    history=None,
+    trace_file=None,
+    job_timeout=None,
+    total_timeout=None,
+    fail_fast=False,
+    fail_fast_cancel=False,
+    max_output=None,
+    spool_threshold=SPOOL_THRESHOLD,
+    result_callback=None,
+    resource_limits=None,
+    stream=False,
+    show_stats=False,
+    metadata_cache=None,
+):
     if debug_jobs:
         logger.setLevel(logging.DEBUG)
 
@@ -86,117 +262,558 @@ def execute_jobs(jobs, show_progress=False, number_of_workers=10, debug_jobs=Fal
 
     results = []
 
-    job_queue = Queue()
-    result_queue = Queue()
-
-    # create worker threads
-    workers = []
-    for _ in range(min(number_of_workers, len(jobs))):
-        worker = Worker(job_queue, result_queue)
-        workers.append(worker)
-
-    # fill job_queue with jobs for each worker
-    pending_jobs = list(jobs)
-    running_job_paths = []
-    while job_queue.qsize() < len(workers):
-        job = get_ready_job(pending_jobs)
-        if not job:
-            break
-        running_job_paths.append(job['client'].path)
-        logger.debug("started '%s'" % job['client'].path)
-        job_queue.put(job)
-    logger.debug('ongoing %s' % running_job_paths)
-
-    # start all workers
-    [w.start() for w in workers]
-
-    # collect results
-    while len(results) < len(jobs):
-        (job, result) = result_queue.get()
-        logger.debug("finished '%s'" % job['client'].path)
-        running_job_paths.remove(result['job']['client'].path)
-        if show_progress and len(jobs) > 1:
-            if result['returncode'] == NotImplemented:
-                streams.stdout.write('s')
-            elif result['returncode']:
-                streams.stdout.write('E')
+    with _execution_context(trace_file, show_stats):
+        result_queue = Queue()
+
+        # the thread generating the jobs which are still being found, they
+        # are dispatched as they arrive
+        producer = None
+        if not hasattr(jobs, '__len__'):
+            if history:
+                # the priorities depend on all jobs
+                jobs = list(jobs)
             else:
-                streams.stdout.write('.')
-            if debug_jobs:
-                streams.stdout.write('\n')
-            streams.stdout.flush()
-        result.update(job)
-        results.append(result)
-        if pending_jobs:
-            for pending_job in pending_jobs:
-                pending_job.get('depends', set()).discard(job['client'].path)
-            while job_queue.qsize() < len(workers):
-                job = get_ready_job(pending_jobs)
+                producer = JobProducer(jobs, result_queue)
+                producer.start()
+                jobs = []
+
+        scheduler = JobScheduler(
+            host_limits=host_limits, default_host_limit=default_host_limit
+        )
+        priorities = {}
+        if history:
+            # dispatch the jobs expected to take longest first
+            priorities = get_critical_path_durations(
+                jobs, history.get_expected_durations(jobs)
+            )
+        for job in jobs:
+            scheduler.add(job, priority=priorities.get(id(job), 0))
+
+        # create the engine running the jobs, the number of workers is only
+        # limited by the number of jobs if all of them are known
+        if producer is None:
+            number_of_workers = min(number_of_workers, len(jobs))
+        if not number_of_workers:
+            return results
+        engine = ThreadEngine(result_queue, number_of_workers)
+        running_job_paths = {}
+        start_times = {}
+        finish_times = {}
+        execution_start = time.monotonic()
+        # id(job) -> state to cancel the subprocesses of a running job
+        job_states = {}
+        # id(job) -> time at which a running job times out
+        deadlines = {}
+        total_deadline = execution_start + total_timeout if total_timeout else None
+        # the reason why no further jobs are dispatched
+        skip_reason = None
+        # id(job) -> (job, event) of running jobs waiting to retry a step,
+        # they don't count against the number of workers
+        parked = {}
+        # only kill entire process groups if necessary since a new session
+        # prevents the commands from prompting on the terminal
+        isolate_processes = bool(job_timeout or total_timeout or fail_fast_cancel)
+        resources = ResourceLimits(resource_limits)
+        # large outputs are kept in a temporary file until they are printed
+        spool = OutputSpool(spool_threshold)
+        # the number of workers is the upper bound for the adaptive concurrency
+        concurrency = AdaptiveConcurrency(number_of_workers) if adaptive else None
+
+        def get_free_slots():
+            limit = concurrency.limit if concurrency else number_of_workers
+            return limit - (len(running_job_paths) - len(parked))
+
+        def dispatch_ready_jobs():
+            while get_free_slots() > 0:
+                # resume jobs waiting to retry a step before starting new ones
+                job = scheduler.pop_delayed()
+                if job:
+                    resume_job(job)
+                    continue
+                if skip_reason is not None:
+                    break
+                job = scheduler.pop_ready()
                 if not job:
                     break
-                running_job_paths.append(job['client'].path)
+                running_job_paths[id(job)] = job['client'].path
+                start_times[id(job)] = time.monotonic()
+                state = JobState(
+                    isolate_processes=isolate_processes,
+                    max_output=max_output,
+                    spool=spool,
+                    resources=resources,
+                    result_queue=result_queue,
+                    path=job['client'].path,
+                    stream=stream,
+                    metadata_cache=metadata_cache,
+                )
+                job_states[id(job)] = _job_states[id(job)] = state
+                if job_timeout:
+                    deadlines[id(job)] = start_times[id(job)] + job_timeout
+                if tracing.tracer:
+                    # the job was ready since the jobs it depends on finished
+                    ready_time = max(
+                        [execution_start]
+                        + [finish_times.get(path, 0) for path in job.get('depends', ())]
+                    )
+                    tracing.tracer.add_async_span(
+                        job['client'].path, 'queued', ready_time, start_times[id(job)]
+                    )
                 logger.debug("started '%s'" % job['client'].path)
-                job_queue.put(job)
-            assert running_job_paths
-        if running_job_paths:
-            logger.debug('ongoing ' + str(running_job_paths))
-    if show_progress and len(jobs) > 1 and not debug_jobs:
-        print('', file=streams.stdout)  # finish progress line
+                engine.submit(job)
+
+        # fill the engine with jobs for each worker
+        dispatch_ready_jobs()
+        logger.debug('ongoing %s' % list(running_job_paths.values()))
+
+        def collect_result(job, result):
+            logger.debug("finished '%s'" % job['client'].path)
+            del running_job_paths[id(job)]
+            deadlines.pop(id(job), None)
+            state = job_states.pop(id(job))
+            _job_states.pop(id(job), None)
+            if state.cancelled:
+                output = result.get('output')
+                result['output'] = state.cancelled + (
+                    '\n' + str(output) if output else ''
+                )
+                if result['returncode'] in (0, None, NotImplemented):
+                    result['returncode'] = 1
+                result['timed_out' if state.timed_out else 'cancelled'] = True
+            # outputs composed by the clients are spooled once the job finished
+            if (
+                isinstance(result.get('output'), str)
+                and len(result['output']) > spool_threshold
+            ):
+                result['output'] = spool.add(result['output'])
+            finish_times[job['client'].path] = time.monotonic()
+            result['duration'] = finish_times[job['client'].path] - start_times.pop(
+                id(job)
+            )
+            if concurrency:
+                concurrency.observe(
+                    result['duration'],
+                    congested=bool(job.get('retries') or result.get('timed_out')),
+                )
+            result.update(job)
+            results.append(result)
+            if result_callback:
+                result_callback(result)
+            scheduler.complete(job)
+            if fail_fast and result['returncode'] not in (0, None, NotImplemented):
+                stop(
+                    "Skipped since the job for '%s' failed" % job['client'].path,
+                    cancel=fail_fast_cancel,
+                )
+            if len(scheduler):
+                dispatch_ready_jobs()
+                assert (
+                    running_job_paths or skip_reason is not None or not len(scheduler)
+                )
+            if running_job_paths:
+                logger.debug('ongoing %s' % list(running_job_paths.values()))
+
+        def add_job(job):
+            # a job generated by the producer
+            jobs.append(job)
+            if skip_reason is None:
+                scheduler.add(job)
+                dispatch_ready_jobs()
+
+        def park_job(job, request):
+            if job_states[id(job)].cancelled is not None:
+                # let the cancelled job fail right away
+                request.event.set()
+                return
+            logger.debug(
+                "'%s' waits %.1fs to retry" % (job['client'].path, request.delay)
+            )
+            parked[id(job)] = (job, request.event)
+            scheduler.add_delayed(job, request.delay)
+            # the worker thread is blocked until the job is resumed, another
+            # worker runs other jobs in the meantime
+            engine.set_number_of_workers(number_of_workers + len(parked))
+            dispatch_ready_jobs()
+
+        def resume_job(job):
+            _, event = parked.pop(id(job))
+            # stop the additional worker again
+            engine.set_number_of_workers(number_of_workers + len(parked))
+            event.set()
+
+        def cancel_job(key, reason, timed_out=False):
+            job_states[key].cancel(reason, timed_out=timed_out)
+            if key in parked:
+                # resume the job right away to let it fail
+                job = parked[key][0]
+                scheduler.remove_delayed(job)
+                resume_job(job)
+
+        def stop(reason, cancel=False, timed_out=False):
+            # stop dispatching jobs and optionally cancel the running ones
+            nonlocal skip_reason
+            if skip_reason is not None:
+                return
+            skip_reason = reason
+            if cancel:
+                for key in list(job_states.keys()):
+                    cancel_job(key, reason, timed_out=timed_out)
+                deadlines.clear()
+
+        def cancel_timed_out_jobs():
+            now = time.monotonic()
+            if total_deadline is not None and now >= total_deadline:
+                stop(
+                    'Timed out: the total timeout of %ss expired' % total_timeout,
+                    cancel=True,
+                    timed_out=True,
+                )
+            for key, deadline in list(deadlines.items()):
+                if now >= deadline:
+                    del deadlines[key]
+                    logger.debug("timed out '%s'" % running_job_paths[key])
+                    cancel_job(
+                        key,
+                        'Timed out: the job took longer than %ss' % job_timeout,
+                        timed_out=True,
+                    )
+
+        def get_timeout():
+            # the time until the next job or the total timeout expires or
+            # until the next job waiting to retry can be resumed
+            now = time.monotonic()
+            timeouts = [deadline - now for deadline in deadlines.values()]
+            if total_deadline is not None and skip_reason is None:
+                timeouts.append(total_deadline - now)
+            if get_free_slots() > 0:
+                next_delay = scheduler.get_next_delay()
+                if next_delay is not None:
+                    timeouts.append(next_delay)
+            if not timeouts:
+                return None
+            return max(0, min(timeouts))
+
+        # collect results and the jobs generated meanwhile
+        try:
+            while running_job_paths or producer is not None:
+                try:
+                    (job, result) = result_queue.get(timeout=get_timeout())
+                except Empty:
+                    cancel_timed_out_jobs()
+                    dispatch_ready_jobs()
+                    continue
+                if result is JobProducer.JOB:
+                    add_job(job)
+                elif result is JobProducer.DONE:
+                    producer.join()
+                    if producer.error is not None:
+                        raise producer.error
+                    producer = None
+                elif isinstance(result, RetryRequest):
+                    park_job(job, result)
+                else:
+                    collect_result(job, result)
+        except KeyboardInterrupt:
+            # kill the subprocesses of all running jobs instead of waiting for them
+            stop('Interrupted', cancel=True)
+            raise
+        finally:
+            for key in job_states:
+                _job_states.pop(key, None)
+
+        if skip_reason is not None:
+            # report the jobs which have not been dispatched
+            collected = {id(result['job']) for result in results}
+            for job in jobs:
+                if id(job) not in collected:
+                    result = {
+                        'cmd': '',
+                        'cwd': job['client'].path,
+                        'job': job,
+                        'output': skip_reason,
+                        'returncode': NotImplemented,
+                        'skipped': True,
+                    }
+                    result.update(job)
+                    results.append(result)
+                    if result_callback:
+                        result_callback(result)
+        if concurrency:
+            print(
+                'Adaptive concurrency settled on %d parallel jobs' % concurrency.limit,
+                file=streams.stderr,
+            )
 
-    # join all workers
-    for w in workers:
-        w.done = True
-    [w.join() for w in workers]
-    return results
+        engine.shutdown()
+        if history:
+            history.record(results)
+        if metadata_cache:
+            metadata_cache.save()
+        return results
+
+
+@contextmanager
+def _execution_context(trace_file, show_stats):
+    # the state shared by all jobs of a single execution
+    with tracing.trace_to_file(trace_file), stats.collect_to_stderr(show_stats):
+        with query_cache.enabled():
+            yield
+
+
+class ThreadEngine(object):
+    """Run each job on one of a number of worker threads."""
+
+    def __init__(self, result_queue, number_of_workers):
+        self.job_queue = Queue()
+        self.result_queue = result_queue
+        self.workers = []
+        # the number of workers which haven't been asked to stop
+        self._number_of_workers = 0
+        self._started = 0
+        self.set_number_of_workers(number_of_workers)
+
+    def set_number_of_workers(self, number_of_workers):
+        """
+        Start or stop workers, e.g. while jobs wait to retry a step.
+
+        A worker is only stopped once it finished its current job, the
+        executor must not submit more jobs than there are workers.
+        """
+        while self._number_of_workers < number_of_workers:
+            worker = Worker(self.job_queue, self.result_queue)
+            worker.name = 'vcs2l-worker-%d' % self._started
+            worker.start()
+            self._started += 1
+            self._number_of_workers += 1
+            # forget the workers which have been stopped before
+            self.workers = [w for w in self.workers if w.is_alive()]
+            self.workers.append(worker)
+        while self._number_of_workers > number_of_workers:
+            self.job_queue.put(Worker.STOP)
+            self._number_of_workers -= 1
+
+    def submit(self, job):
+        self.job_queue.put(job)
+
+    def shutdown(self):
+        # stop and join all workers
+        self.set_number_of_workers(0)
+        [w.join() for w in self.workers]
 
 
 class Worker(threading.Thread):
+    # sentinel put into the job queue once per worker to shut it down
+    STOP = None
+
     def __init__(self, job_queue, result_queue):
         super(Worker, self).__init__()
         self.daemon = True
-        self.done = False
         self.job_queue = job_queue
         self.result_queue = result_queue
 
     def run(self):
-        # process all incoming jobs
-        while not self.done:
-            try:
-                # fetch next job
-                job = self.job_queue.get(timeout=0.1)
-                # process job
-                result = self.process_job(job)
-                # send result
-                self.result_queue.put((job, result))
-            except Empty:
-                pass
-
-    def process_job(self, job):
-        command = job['command']
-        if not command:
-            return {'cmd': '', 'job': job, 'output': job['output'], 'returncode': 1}
-        method_name = command.__class__.command
+        # process all incoming jobs until the sentinel is received
+        while True:
+            # block until the next job is available
+            job = self.job_queue.get()
+            if job is Worker.STOP:
+                break
+            # process job
+            result = process_job(job)
+            # send result
+            self.result_queue.put((job, result))
+
+
+class JobProducer(threading.Thread):
+    """
+    Generate the jobs in a thread, e.g. while the repositories are found.
+
+    Each job is sent to the executor as soon as it has been generated, so the
+    executor keeps collecting results and enforcing timeouts while it waits
+    for the next job.
+    """
+
+    # sent instead of a result with each generated job
+    JOB = object()
+    # sent instead of a result once all jobs have been generated
+    DONE = object()
+
+    def __init__(self, jobs, result_queue):
+        super(JobProducer, self).__init__()
+        self.daemon = True
+        self.name = 'vcs2l-jobs'
+        self.jobs = jobs
+        self.result_queue = result_queue
+        # the exception raised while generating the jobs if any
+        self.error = None
+
+    def run(self):
         try:
-            method = getattr(job['client'], method_name, None)
-            if method is None:
-                return {
-                    'cmd': '%s.%s(%s)'
-                    % (
-                        job['client'].__class__.type,
-                        method_name,
-                        job['command'].__class__.command,
-                    ),
-                    'job': job,
-                    'output': "Command '%s' not implemented for client '%s'"
-                    % (job['command'].__class__.command, job['client'].__class__.type),
-                    'returncode': NotImplemented,
-                }
-            result = method(job['command'])
-            result['job'] = job
-            return result
+            for job in self.jobs:
+                self.result_queue.put((job, JobProducer.JOB))
         except Exception as e:
-            exc_tb = sys.exc_info()[2]
-            filename, lineno, _, _ = traceback.extract_tb(exc_tb)[-1]
+            self.error = e
+        finally:
+            self.result_queue.put((None, JobProducer.DONE))
+
+
+# state of the current worker thread
+_worker_state = threading.local()
+
+
+def get_current_job():
+    """Return the job processed by this thread."""
+    return getattr(_worker_state, 'job', None)
+
+
+# id(job) -> state of each running job
+_job_states = {}
+
+
+def get_current_job_state():
+    """Return the state of the job processed by this thread."""
+    job = get_current_job()
+    if job is None:
+        return None
+    return _job_states.get(id(job))
+
+
+class RetryRequest(object):
+    """Sent by a job to give up its worker until it may retry a step."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.event = threading.Event()
+
+
+class JobState(object):
+    """
+    Track the subprocesses of a running job to be able to cancel it.
+
+    Once the job has been cancelled all its subprocesses are killed and
+    no new subprocesses are started.
+    """
+
+    def __init__(
+        self,
+        isolate_processes=False,
+        max_output=None,
+        spool=None,
+        resources=None,
+        result_queue=None,
+        path=None,
+        stream=False,
+        metadata_cache=None,
+    ):
+        # spawn each subprocess in a new session to kill its entire tree
+        self.isolate_processes = isolate_processes
+        # the maximum number of bytes kept from the output of each subprocess
+        self.max_output = max_output
+        # the spool of large outputs shared by all jobs
+        self.spool = spool
+        # the resource limits shared by all jobs
+        self.resources = resources
+        # the queue to notify the executor
+        self._result_queue = result_queue
+        # the path of the repository
+        self.path = path
+        # output the lines of the subprocesses as they arrive
+        self.stream = stream
+        # the metadata cache shared by all jobs
+        self.metadata_cache = metadata_cache
+        # the reason why the job has been cancelled
+        self.cancelled = None
+        self.timed_out = False
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    def add_process(self, proc):
+        """Track the process, kill it if the job has been cancelled."""
+        with self._lock:
+            if self.cancelled is None:
+                self._processes.add(proc)
+                return True
+        self._kill(proc)
+        return False
+
+    def wait_for_retry(self, job, delay):
+        """
+        Wait until the job may retry a failed step.
+
+        The executor can run other jobs in the meantime and resumes this job
+        after the delay expired and a worker is available.
+        """
+        if self._result_queue is None:
+            time.sleep(delay)
+            return
+        request = RetryRequest(delay)
+        self._result_queue.put((job, request))
+        request.event.wait()
+
+    def remove_process(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+    def cancel(self, reason, timed_out=False):
+        with self._lock:
+            if self.cancelled is not None:
+                return
+            self.cancelled = reason
+            self.timed_out = timed_out
+            processes = list(self._processes)
+        for proc in processes:
+            self._kill(proc)
+
+    def _kill(self, proc):
+        if proc.returncode is not None:
+            # the process has already been reaped
+            return
+        try:
+            if sys.platform == 'win32':
+                # kill the process including all its child processes
+                subprocess.call(
+                    ['taskkill', '/F', '/T', '/PID', str(proc.pid)],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            elif self.isolate_processes:
+                # the process is the leader of its own process group
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                os.kill(proc.pid, signal.SIGKILL)
+        except OSError:
+            # the process has already terminated
+            pass
+
+
+def process_job(job):
+    _worker_state.job = job
+    try:
+        state = get_current_job_state()
+        if state is not None and state.cancelled is not None:
+            # the job has been cancelled before it started
+            return {'cmd': '', 'job': job, 'output': 'Not started', 'returncode': 1}
+        with tracing.span(
+            job['client'].path,
+            'job',
+            client=job['client'].__class__.type,
+            command=job['command'].__class__.command if job['command'] else None,
+        ) as trace_args:
+            result = _process_job(job)
+            trace_args['returncode'] = str(result['returncode'])
+        return result
+    finally:
+        _worker_state.job = None
+
+
+def _process_job(job):
+    command = job['command']
+    if not command:
+        return {'cmd': '', 'job': job, 'output': job['output'], 'returncode': 1}
+    method_name = command.__class__.command
+    try:
+        method = getattr(job['client'], method_name, None)
+        if method is None:
             return {
                 'cmd': '%s.%s(%s)'
                 % (
@@ -205,25 +822,45 @@ class Worker(threading.Thread):
                     job['command'].__class__.command,
                 ),
                 'job': job,
-                'output': "Invocation of command '%s' on client '%s' failed: "
-                '%s: %s (%s:%s)'
-                % (
-                    job['command'].__class__.command,
-                    job['client'].__class__.type,
-                    type(e).__name__,
-                    e,
-                    filename,
-                    lineno,
-                ),
-                'returncode': 1,
+                'output': "Command '%s' not implemented for client '%s'"
+                % (job['command'].__class__.command, job['client'].__class__.type),
+                'returncode': NotImplemented,
             }
+        result = method(job['command'])
+        result['job'] = job
+        return result
+    except Exception as e:
+        exc_tb = sys.exc_info()[2]
+        filename, lineno, _, _ = traceback.extract_tb(exc_tb)[-1]
+        return {
+            'cmd': '%s.%s(%s)'
+            % (
+                job['client'].__class__.type,
+                method_name,
+                job['command'].__class__.command,
+            ),
+            'job': job,
+            'output': "Invocation of command '%s' on client '%s' failed: "
+            '%s: %s (%s:%s)'
+            % (
+                job['command'].__class__.command,
+                job['client'].__class__.type,
+                type(e).__name__,
+                e,
+                filename,
+                lineno,
+            ),
+            'returncode': 1,
+        }
 
 
 def output_result(result, hide_empty=False):
-    output = result['output']
+    output = str(result['output'])
     if hide_empty and result['returncode'] is None:
         output = ''
-    if result['returncode'] == NotImplemented:
+    if result.get('skipped'):
+        output = ansi('cyanf') + output + ansi('reset')
+    elif result['returncode'] == NotImplemented:
         if output:
             output = ansi('yellowf') + output + ansi('reset')
     elif result['returncode']:
@@ -256,6 +893,36 @@ def output_result(result, hide_empty=False):
             )
 
 
+def output_json_result(result, hide_empty=False):
+    """Output the result as a single line of JSON (JSON Lines)."""
+    output = str(result['output'])
+    if hide_empty:
+        # like output_result() hide the notices about duplicate repositories
+        # and results without output unless they failed
+        failed = result['returncode'] not in (0, None, NotImplemented)
+        if result['returncode'] is None or (not output and not failed):
+            return
+    data = {
+        'path': fix_output_path(result['client'].path),
+        'type': result['client'].__class__.type,
+        'cmd': result['cmd'],
+        # not applicable commands have no return code
+        'returncode': None
+        if result['returncode'] == NotImplemented
+        else result['returncode'],
+        'duration': result.get('duration'),
+    }
+    for flag in ('skipped', 'timed_out', 'cancelled'):
+        if result.get(flag):
+            data[flag] = True
+    if 'export_data' in result:
+        data['export_data'] = result['export_data']
+    else:
+        data['output'] = output
+    print(json.dumps(data, sort_keys=True), file=streams.stdout)
+    streams.stdout.flush()
+
+
 def output_results(results, output_handler=output_result, hide_empty=False):
     # output results in alphabetic order
     path_to_idx = {result['client'].path: i for i, result in enumerate(results)}
@@ -264,6 +931,56 @@ def output_results(results, output_handler=output_result, hide_empty=False):
         output_handler(results[i], hide_empty=hide_empty)
 
 
+class OrderedResultWriter(object):
+    """
+    Output results in alphabetic order as soon as possible.
+
+    A result is output once the results of all paths sorting before it have
+    been output, so the order is the same as with :func:`output_results`
+    while the results are shown before all jobs have finished.
+    """
+
+    def __init__(self, paths=None, output_handler=output_result, hide_empty=False):
+        self.output_handler = output_handler
+        self.hide_empty = hide_empty
+        # None until the paths of jobs passed to track() are known
+        self._paths = sorted(set(paths)) if paths is not None else None
+        self._index = 0
+        # path -> result which has to wait for results of earlier paths
+        self._pending = {}
+        # the jobs passed to track() might be generated by another thread
+        self._lock = threading.Lock()
+
+    def track(self, jobs):
+        """
+        Generate the jobs while collecting their paths.
+
+        The results are output once all jobs have been generated since the
+        paths of later jobs might sort before the paths of finished ones.
+        """
+        paths = []
+        for job in jobs:
+            paths.append(job['client'].path)
+            yield job
+        with self._lock:
+            self._paths = sorted(set(paths))
+            self._output_ready_results()
+
+    def __call__(self, result):
+        with self._lock:
+            self._pending[result['client'].path] = result
+            if self._paths is not None:
+                self._output_ready_results()
+
+    def _output_ready_results(self):
+        while (
+            self._index < len(self._paths) and self._paths[self._index] in self._pending
+        ):
+            result = self._pending.pop(self._paths[self._index])
+            self._index += 1
+            self.output_handler(result, hide_empty=self.hide_empty)
+
+
 USE_COLOR = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
 # disable color on Windows except if ConEmuANSI is explicitly enabled
 if os.name == 'nt' and os.environ.get('ConEmuANSI', None) != 'ON':
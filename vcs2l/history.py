@@ -0,0 +1,104 @@
+import os
+import time
+
+from vcs2l.util import DATABASE_ERRORS, get_user_cache_dir, sqlite3, warn
+
+
+class JobHistory(object):
+    """
+    Persist the durations of jobs across invocations.
+
+    The durations are stored in a SQLite database in the user cache directory
+    and keyed by the command name and the URL of the command (e.g. for
+    import) or otherwise the real path of the repository.
+    Repeated runs are averaged using an exponential moving average.
+    """
+
+    # weight of the latest duration in the moving average
+    SMOOTHING = 0.5
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_user_cache_dir(), 'job_history.sqlite3')
+
+    def _connect(self):
+        if sqlite3 is None:
+            raise RuntimeError('Python was built without sqlite3 support')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS job_durations ('
+            'command TEXT NOT NULL, key TEXT NOT NULL, duration REAL NOT NULL, '
+            'updated REAL NOT NULL, PRIMARY KEY (command, key))'
+        )
+        return connection
+
+    def get_expected_durations(self, jobs):
+        """Get a mapping from id(job) to the expected duration of the job."""
+        keys = {id(job): get_history_key(job) for job in jobs}
+        durations = {}
+        try:
+            connection = self._connect()
+            try:
+                for job_id, key in keys.items():
+                    if key is None:
+                        continue
+                    row = connection.execute(
+                        'SELECT duration FROM job_durations '
+                        'WHERE command = ? AND key = ?',
+                        key,
+                    ).fetchone()
+                    if row:
+                        durations[job_id] = row[0]
+            finally:
+                connection.close()
+        except DATABASE_ERRORS as e:
+            warn('Could not read job history: %s' % e)
+        return durations
+
+    def record(self, results):
+        """
+        Store the durations of the successful jobs.
+
+        Failed jobs (including skipped, cancelled and timed out ones) often
+        stop early or are cut off, so their durations aren't recorded.
+        """
+        rows = []
+        now = time.time()
+        for result in results:
+            key = get_history_key(result)
+            if key is None or result['returncode'] != 0:
+                continue
+            rows.append(key + (result['duration'], now))
+        if not rows:
+            return
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    for command, key, duration, updated in rows:
+                        # avoid UPSERT which requires SQLite 3.24
+                        connection.execute(
+                            'INSERT OR IGNORE INTO job_durations VALUES (?, ?, ?, ?)',
+                            (command, key, duration, updated),
+                        )
+                        connection.execute(
+                            'UPDATE job_durations '
+                            'SET duration = duration + ? * (? - duration), '
+                            'updated = ? WHERE command = ? AND key = ?',
+                            (self.SMOOTHING, duration, updated, command, key),
+                        )
+            finally:
+                connection.close()
+        except DATABASE_ERRORS as e:
+            warn('Could not record job history: %s' % e)
+
+
+def get_history_key(job):
+    command = job['command']
+    if command is None:
+        return None
+    url = getattr(command, 'url', None)
+    return (
+        command.__class__.command,
+        url or os.path.realpath(job['client'].path),
+    )
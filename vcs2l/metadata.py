@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+from vcs2l.util import DATABASE_ERRORS, get_user_cache_dir, sqlite3, warn
+
+
+class MetadataCache(object):
+    """
+    Persist the metadata of repositories across invocations.
+
+    The metadata (e.g. the refs and the remotes) is stored in a SQLite
+    database in the user cache directory and keyed by the real path of the
+    repository.
+    Each entry is stored together with a signature of the repository state
+    (e.g. the stat information of the files containing the refs) and is only
+    valid as long as the signature doesn't change.
+
+    All entries are read on first use and the updated entries are written
+    at once when saved.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_user_cache_dir(), 'metadata_cache.sqlite3')
+        self._lock = threading.Lock()
+        # repository -> (signature, data)
+        self._entries = None
+        self._updated = set()
+
+    def _connect(self):
+        if sqlite3 is None:
+            raise RuntimeError('Python was built without sqlite3 support')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS repository_metadata ('
+            'repository TEXT NOT NULL PRIMARY KEY, signature TEXT NOT NULL, '
+            'data TEXT NOT NULL)'
+        )
+        return connection
+
+    def _load(self):
+        self._entries = {}
+        try:
+            connection = self._connect()
+            try:
+                for repository, signature, data in connection.execute(
+                    'SELECT repository, signature, data FROM repository_metadata'
+                ):
+                    self._entries[repository] = (signature, data)
+            finally:
+                connection.close()
+        except DATABASE_ERRORS as e:
+            warn('Could not read metadata cache: %s' % e)
+
+    def get(self, repository, signature):
+        """Get the metadata if the signature matches, otherwise None."""
+        signature = json.dumps(signature)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(repository)
+        if entry is None or entry[0] != signature:
+            return None
+        return json.loads(entry[1])
+
+    def set(self, repository, signature, data):
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._entries[repository] = (json.dumps(signature), json.dumps(data))
+            self._updated.add(repository)
+
+    def save(self):
+        """Store the updated entries."""
+        with self._lock:
+            rows = [(r,) + self._entries[r] for r in sorted(self._updated)]
+            self._updated.clear()
+        if not rows:
+            return
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO repository_metadata VALUES (?, ?, ?)',
+                        rows,
+                    )
+            finally:
+                connection.close()
+        except DATABASE_ERRORS as e:
+            warn('Could not store metadata cache: %s' % e)
@@ -0,0 +1,69 @@
+import threading
+from contextlib import contextmanager
+
+# the cache of the results of read-only commands, None if disabled
+cache = None
+# the maximum length of the output of a memoized result
+MAX_OUTPUT_LENGTH = 64 * 1024
+
+
+def set_cache(cache_):
+    global cache
+    cache = cache_
+
+
+class QueryCache(object):
+    """
+    Memoize the successful results of read-only commands per repository.
+
+    The repository is identified by its real path, so repositories reached
+    through several (symlinked) paths share their entries.
+    A command which might change the repository invalidates all its entries.
+    Each invalidation increments a generation counter of the repository and
+    a result is only stored if the generation didn't change while the
+    command was running.
+    Large and spooled outputs aren't stored, they would otherwise be kept in
+    memory for the rest of the run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # repository -> {key: result}
+        self._results = {}
+        # repository -> number of invalidations
+        self._generations = {}
+
+    def get(self, repository, key):
+        """
+        Get a copy of the cached result and the generation of the repository.
+
+        The result is None if it hasn't been cached.
+        """
+        with self._lock:
+            result = self._results.get(repository, {}).get(key)
+            generation = self._generations.get(repository, 0)
+        return (dict(result) if result is not None else None), generation
+
+    def add(self, repository, key, result, generation):
+        output = result.get('output')
+        if not isinstance(output, str) or len(output) > MAX_OUTPUT_LENGTH:
+            return
+        with self._lock:
+            if self._generations.get(repository, 0) == generation:
+                self._results.setdefault(repository, {})[key] = dict(result)
+
+    def invalidate(self, repository):
+        with self._lock:
+            self._results.pop(repository, None)
+            self._generations[repository] = self._generations.get(repository, 0) + 1
+
+
+@contextmanager
+def enabled():
+    """Memoize the results of read-only commands invoked within the block."""
+    previous = cache
+    set_cache(QueryCache())
+    try:
+        yield
+    finally:
+        set_cache(previous)
@@ -0,0 +1,311 @@
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+
+from vcs2l.util import get_url_host
+
+
+class JobScheduler(object):
+    """
+    Hand out jobs once all the paths they depend on have been completed.
+
+    Each job may contain a set of paths in its ``depends`` entry (see
+    :func:`vcs2l.commands.import_.add_dependencies`).
+    Instead of scanning all pending jobs the scheduler keeps a reverse index
+    from each path to the jobs depending on it as well as the number of
+    unfinished dependencies per job.
+    Ready jobs are kept in a priority queue, jobs with a higher priority are
+    dispatched first and jobs with the same priority in the order they became
+    ready.
+    Adding, dispatching and completing a job is therefore O(log n) amortized
+    (per dependency edge).
+
+    Optionally the number of concurrently running jobs per network host can be
+    limited.
+    Ready jobs for a host without free slots are deferred until a job for the
+    same host completes, so ready jobs for other hosts are dispatched first.
+
+    Jobs which have already been dispatched can be delayed, e.g. while they
+    wait to retry a failed step, and are handed out again once the delay
+    expired.
+    """
+
+    def __init__(
+        self, jobs=None, host_limits=None, default_host_limit=None, clock=time.monotonic
+    ):
+        # path -> list of jobs waiting for a job with that path to finish
+        self._dependents = {}
+        # id(job) -> number of unfinished dependencies
+        self._in_degree = {}
+        self._finished_paths = set()
+        # heap of (-priority, sequence number, job)
+        self._ready = []
+        self._sequence = itertools.count()
+        # id(job) -> priority
+        self._priorities = {}
+        self._pending_count = 0
+
+        self._host_limits = {
+            host.lower(): limit for host, limit in (host_limits or {}).items()
+        }
+        self._default_host_limit = default_host_limit
+        # id(job) -> host of jobs with a limited host
+        self._hosts = {}
+        # host -> number of running jobs
+        self._running_per_host = {}
+        # host -> ready jobs waiting for a free slot
+        self._deferred = {}
+
+        self._clock = clock
+        # heap of (due time, sequence number, job)
+        self._delayed = []
+        # id(job) -> sequence number of the valid heap entry of a delayed job
+        self._delayed_sequences = {}
+
+        for job in jobs or []:
+            self.add(job)
+
+    def __len__(self):
+        """Return the number of jobs which have not been dispatched yet."""
+        return self._pending_count
+
+    def add(self, job, priority=0):
+        self._pending_count += 1
+        if priority:
+            self._priorities[id(job)] = priority
+        if self._host_limits or self._default_host_limit:
+            host = get_job_host(job)
+            if self._get_host_limit(host) is not None:
+                self._hosts[id(job)] = host
+        in_degree = 0
+        for path in job.get('depends', ()):
+            if path in self._finished_paths:
+                continue
+            self._dependents.setdefault(path, []).append(job)
+            in_degree += 1
+        if in_degree:
+            self._in_degree[id(job)] = in_degree
+        else:
+            self._push_ready(job)
+
+    def _push_ready(self, job, first=False):
+        sequence = next(self._sequence)
+        heapq.heappush(
+            self._ready,
+            (
+                -self._priorities.get(id(job), 0),
+                -sequence if first else sequence,
+                job,
+            ),
+        )
+
+    def pop_ready(self):
+        """Return the next job without unfinished dependencies or None."""
+        while self._ready:
+            _, _, job = heapq.heappop(self._ready)
+            host = self._hosts.get(id(job))
+            if host is not None:
+                running = self._running_per_host.get(host, 0)
+                if running >= self._get_host_limit(host):
+                    self._deferred.setdefault(host, deque()).append(job)
+                    continue
+                self._running_per_host[host] = running + 1
+            self._pending_count -= 1
+            self._priorities.pop(id(job), None)
+            return job
+        return None
+
+    def complete(self, job):
+        """Mark the job as finished and release the jobs depending on it."""
+        host = self._hosts.pop(id(job), None)
+        if host is not None:
+            self._running_per_host[host] -= 1
+            deferred = self._deferred.get(host)
+            if deferred:
+                self._push_ready(deferred.popleft(), first=True)
+
+        path = job['client'].path
+        self._finished_paths.add(path)
+        for dependent in self._dependents.pop(path, ()):
+            key = id(dependent)
+            self._in_degree[key] -= 1
+            if not self._in_degree[key]:
+                del self._in_degree[key]
+                self._push_ready(dependent)
+
+    def add_delayed(self, job, delay):
+        """Hand out the dispatched job again after the delay (in seconds)."""
+        self._pending_count += 1
+        sequence = next(self._sequence)
+        self._delayed_sequences[id(job)] = sequence
+        heapq.heappush(self._delayed, (self._clock() + delay, sequence, job))
+
+    def remove_delayed(self, job):
+        """Remove a delayed job before its delay expired."""
+        self._pending_count -= 1
+        # the heap entry is discarded once it reaches the top
+        del self._delayed_sequences[id(job)]
+
+    def pop_delayed(self):
+        """Return the next delayed job whose delay expired or None."""
+        self._discard_removed_delayed()
+        if not self._delayed or self._delayed[0][0] > self._clock():
+            return None
+        _, _, job = heapq.heappop(self._delayed)
+        del self._delayed_sequences[id(job)]
+        self._pending_count -= 1
+        return job
+
+    def get_next_delay(self):
+        """Return the time until the next delayed job is due or None."""
+        self._discard_removed_delayed()
+        if not self._delayed:
+            return None
+        return max(0.0, self._delayed[0][0] - self._clock())
+
+    def _discard_removed_delayed(self):
+        while self._delayed:
+            _, sequence, job = self._delayed[0]
+            if self._delayed_sequences.get(id(job)) == sequence:
+                break
+            heapq.heappop(self._delayed)
+
+    def _get_host_limit(self, host):
+        if host is None:
+            return None
+        return self._host_limits.get(host, self._default_host_limit)
+
+
+def get_job_host(job):
+    """
+    Get the network host a job is going to contact.
+
+    The host is determined from the URL of the command (e.g. for import and
+    validate) or otherwise from the remote URL of the repository.
+    """
+    url = getattr(job['command'], 'url', None)
+    if url is None and job['command'] is not None:
+        url = job['client'].read_remote_url()
+    return get_url_host(url)
+
+
+def get_critical_path_durations(jobs, durations):
+    """
+    Get the expected duration of each job including its longest chain of
+    dependent jobs.
+
+    Using these as priorities dispatches the jobs blocking most of the
+    remaining work first which minimizes the overall duration.
+    Jobs without a known duration are assumed to take the average duration.
+
+    :param durations: a mapping from id(job) to the expected duration
+    :returns: a mapping from id(job) to the critical path duration
+    """
+    default = sum(durations.values()) / len(durations) if durations else 0.0
+    dependents = {}
+    for job in jobs:
+        for path in job.get('depends', ()):
+            dependents.setdefault(path, []).append(job)
+
+    critical_paths = {}
+
+    def get_critical_path(job):
+        key = id(job)
+        if key not in critical_paths:
+            critical_paths[key] = durations.get(key, default) + max(
+                [
+                    get_critical_path(dependent)
+                    for dependent in dependents.get(job['client'].path, ())
+                ]
+                or [0.0]
+            )
+        return critical_paths[key]
+
+    for job in jobs:
+        get_critical_path(job)
+    return critical_paths
+
+
+def get_retry_delay(attempt, base=1.0, maximum=30.0):
+    """
+    Get the delay before retrying a failed step.
+
+    The delay grows exponentially with each attempt.
+    A random jitter prevents jobs which failed at the same time, e.g. due to
+    an unavailable host, from retrying at the same time again.
+    """
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class AdaptiveConcurrency(object):
+    """
+    Adapt the number of concurrently running jobs (AIMD).
+
+    The throughput and the average job duration are measured over windows of
+    as many completed jobs as the current limit.
+    Starting with a small limit it is doubled while the throughput improves,
+    afterwards it grows additively by one as long as the throughput keeps
+    improving.
+    When jobs needed retries, timed out or the average duration rises
+    significantly above the best observed one the limit is halved.
+    """
+
+    # throughput has to increase by this factor to count as improvement
+    IMPROVEMENT_FACTOR = 1.05
+    # average duration relative to the best one which indicates congestion
+    LATENCY_FACTOR = 2.0
+
+    def __init__(self, maximum, initial=4, minimum=1, clock=time.monotonic):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.limit = max(self.minimum, min(initial, maximum))
+        self._clock = clock
+        self._slow_start = True
+        self._best_throughput = None
+        self._best_latency = None
+        self._start_window()
+
+    def _start_window(self):
+        self._window_start = self._clock()
+        self._window_completed = 0
+        self._window_duration = 0.0
+        self._window_congested = False
+
+    def observe(self, duration, congested=False):
+        """Record the duration of a finished job and adapt the limit."""
+        self._window_completed += 1
+        self._window_duration += duration
+        self._window_congested |= congested
+        if self._window_completed < self.limit:
+            return
+
+        elapsed = max(self._clock() - self._window_start, 1e-6)
+        throughput = self._window_completed / elapsed
+        latency = self._window_duration / self._window_completed
+        if self._window_congested or (
+            self._best_latency is not None
+            and latency > self._best_latency * self.LATENCY_FACTOR
+        ):
+            # multiplicative decrease
+            self.limit = max(self.minimum, self.limit // 2)
+            self._slow_start = False
+            # the throughput at the new limit has to be measured again
+            self._best_throughput = None
+        elif (
+            self._best_throughput is None
+            or throughput > self._best_throughput * self.IMPROVEMENT_FACTOR
+        ):
+            if self._slow_start:
+                self.limit = min(self.maximum, self.limit * 2)
+            else:
+                # additive increase
+                self.limit = min(self.maximum, self.limit + 1)
+            self._best_throughput = max(throughput, self._best_throughput or 0)
+        else:
+            self._slow_start = False
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        self._start_window()
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import vcs2l.streams as streams
+
+# the statistics of the spawned processes, None if not collected
+collector = None
+
+# the number of repositories with the most processes which are listed
+TOP_REPOSITORIES = 5
+
+
+def set_collector(collector_):
+    global collector
+    collector = collector_
+
+
+class ProcessStats(object):
+    """
+    Count the spawned subprocesses per repository and per subcommand.
+
+    Beside the number of processes the cumulative wall time of the processes
+    and the number of bytes of their output are recorded.
+    The CPU time of all child processes is measured for the lifetime of the
+    collector.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # subcommand name, e.g. 'git fetch' -> [processes, duration, bytes]
+        self.per_command = {}
+        # repository path -> number of processes
+        self.per_repository = {}
+        self._start = time.monotonic()
+        self._start_cpu_time = get_children_cpu_time()
+
+    def add_process(self, name, repository, duration, output_bytes):
+        with self._lock:
+            totals = self.per_command.setdefault(name, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] += output_bytes
+            self.per_repository[repository] = self.per_repository.get(repository, 0) + 1
+
+    def write(self, stream):
+        wall_time = time.monotonic() - self._start
+        cpu_time = get_children_cpu_time()
+        with self._lock:
+            per_command = sorted(
+                self.per_command.items(), key=lambda item: (-item[1][0], item[0])
+            )
+            per_repository = sorted(
+                self.per_repository.items(), key=lambda item: (-item[1], item[0])
+            )
+        processes = sum(totals[0] for _, totals in per_command)
+        lines = [
+            'Spawned %d processes in %d repositories in %.2fs'
+            % (processes, len(per_repository), wall_time),
+            '  child CPU time: %s'
+            % (
+                '%.2fs' % (cpu_time - self._start_cpu_time)
+                if cpu_time is not None
+                else 'unknown'
+            ),
+            '  process wall time: %.2fs' % sum(totals[1] for _, totals in per_command),
+            '  bytes of output: %d' % sum(totals[2] for _, totals in per_command),
+        ]
+        if per_command:
+            lines.append('Processes per subcommand:')
+            for name, (count, duration, output_bytes) in per_command:
+                lines.append(
+                    '  %s: %d (%.2fs, %d bytes)' % (name, count, duration, output_bytes)
+                )
+        if per_repository:
+            lines.append('Repositories with the most processes:')
+            for repository, count in per_repository[:TOP_REPOSITORIES]:
+                lines.append('  %s: %d' % (repository, count))
+        print('\n'.join(lines), file=stream)
+
+
+def get_children_cpu_time():
+    """Get the user and system CPU time of all terminated child processes."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def collect_to_stderr(enabled):
+    """Collect the statistics of the block and write them if enabled."""
+    if not enabled:
+        yield
+        return
+    set_collector(ProcessStats())
+    try:
+        yield
+    finally:
+        collector.write(streams.stderr)
+        set_collector(None)
+
+
+def add_process(name, repository, duration, output_bytes):
+    """Record a finished subprocess if statistics are collected."""
+    collector_ = collector
+    if collector_ is not None:
+        collector_.add_process(name, repository or os.curdir, duration, output_bytes)
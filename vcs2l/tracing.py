@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# the tracer collecting spans, None if tracing is disabled
+tracer = None
+
+
+def set_tracer(tracer_):
+    global tracer
+    tracer = tracer_
+
+
+class Tracer(object):
+    """
+    Collect timing spans and write them in the Chrome trace event format.
+
+    The resulting file can be loaded in a trace viewer (e.g. Perfetto or
+    chrome://tracing) showing one row per thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+        self._async_ids = 0
+        self._origin = time.monotonic()
+
+    def now(self):
+        return time.monotonic()
+
+    def _timestamp(self, timestamp):
+        # microseconds since the tracer was created
+        return (timestamp - self._origin) * 1e6
+
+    def _tid(self):
+        thread = threading.current_thread()
+        with self._lock:
+            if thread.ident not in self._thread_names:
+                self._thread_names[thread.ident] = thread.name
+        return thread.ident
+
+    def add_span(self, name, category, start, end, args=None):
+        """Add a span for the current thread."""
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': self._timestamp(start),
+            'dur': (end - start) * 1e6,
+            'pid': 0,
+            'tid': self._tid(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    def add_async_span(self, name, category, start, end, args=None):
+        """Add a span which is not bound to a thread (e.g. waiting in a queue)."""
+        with self._lock:
+            self._async_ids += 1
+            event_id = self._async_ids
+        begin = {
+            'name': name,
+            'cat': category,
+            'ph': 'b',
+            'id': event_id,
+            'ts': self._timestamp(start),
+            'pid': 0,
+            'tid': 0,
+        }
+        if args:
+            begin['args'] = args
+        end_event = dict(begin, ph='e', ts=self._timestamp(end))
+        end_event.pop('args', None)
+        with self._lock:
+            self._events += [begin, end_event]
+
+    def add_instant(self, name, category, args=None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'i',
+            's': 't',
+            'ts': self._timestamp(self.now()),
+            'pid': 0,
+            'tid': self._tid(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    def write(self, path):
+        with self._lock:
+            events = [
+                {
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': 0,
+                    'tid': tid,
+                    'args': {'name': name},
+                }
+                for tid, name in self._thread_names.items()
+            ] + self._events
+        with open(path, 'w', encoding='utf-8') as h:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, h)
+
+
+@contextmanager
+def trace_to_file(path):
+    """Trace the block and write the trace to the file if a path is given."""
+    if not path:
+        yield
+        return
+    set_tracer(Tracer())
+    try:
+        yield
+    finally:
+        tracer.write(path)
+        set_tracer(None)
+
+
+@contextmanager
+def span(name, category, **args):
+    """Trace the duration of the block if tracing is enabled."""
+    tracer_ = tracer
+    if tracer_ is None:
+        yield args
+        return
+    start = tracer_.now()
+    try:
+        # the block can add further arguments, e.g. the return code
+        yield args
+    finally:
+        tracer_.add_span(name, category, start, tracer_.now(), args)
+
+
+def instant(name, category, **args):
+    """Trace an event without a duration if tracing is enabled."""
+    tracer_ = tracer
+    if tracer_ is not None:
+        tracer_.add_instant(name, category, args)
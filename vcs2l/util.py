@@ -3,6 +3,19 @@ import stat
 import sys
 from errno import EACCES, EPERM
 from shutil import rmtree as shutil_rmtree
+from urllib.parse import urlparse
+
+import vcs2l.streams as streams
+
+try:
+    import sqlite3
+except ImportError:  # Python might be built without sqlite support
+    sqlite3 = None
+
+# modifications within this many seconds might not change the modification time
+RACY_INTERVAL = 2.0
+# the errors of accessing a database in the user cache directory
+DATABASE_ERRORS = (RuntimeError, OSError) + ((sqlite3.Error,) if sqlite3 else ())
 
 
 def rmtree(path):
@@ -16,3 +29,47 @@ def _onerror_windows(function, path, excinfo):
     if isinstance(excinfo[1], OSError) and excinfo[1].errno in (EACCES, EPERM):
         os.chmod(path, stat.S_IWRITE)
         function(path)
+
+
+def get_user_cache_dir():
+    """Get the directory for cached data of vcs2l of the current user."""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser(os.path.join('~', 'Library', 'Caches'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(
+            os.path.join('~', '.cache')
+        )
+    return os.path.join(base, 'vcs2l')
+
+
+def warn(message):
+    """Output a warning to stderr, e.g. if an optional cache is unusable."""
+    print(message, file=streams.stderr)
+
+
+def get_url_host(url):
+    """
+    Get the lowercase host name of a repository URL.
+
+    Both URLs with a scheme and scp-like ``[user@]host:path`` URLs are
+    supported.
+    Local paths and ``file://`` URLs return None.
+    """
+    if not url:
+        return None
+    if '://' in url:
+        try:
+            return urlparse(url).hostname or None
+        except ValueError:
+            return None
+    # scp-like syntax, the colon must come before the first slash
+    host, sep, _ = url.partition(':')
+    if not sep or '/' in host or '\\' in host:
+        return None
+    host = host.rsplit('@', 1)[-1]
+    # ignore Windows drive letters
+    if len(host) <= 1:
+        return None
+    return host.lower()
@@ -0,0 +1,490 @@
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import socket
+import struct
+import sys
+from contextlib import closing
+
+import vcs2l.executor as executor
+from vcs2l.clients import vcs2l_clients
+from vcs2l.crawler import (
+    IGNORE_FILE,
+    INDEX_DIRECTORY,
+    SKIPPED_DIRECTORIES,
+    crawl_base_path,
+    split_path,
+)
+from vcs2l.util import warn
+
+# the socket of a watcher in the base path it watches
+SOCKET_PATH = os.path.join(INDEX_DIRECTORY, 'watch.sock')
+PROTOCOL_VERSION = 2
+# the seconds a command waits for the answer of a watcher
+QUERY_TIMEOUT = 300
+# the maximum size of a request in bytes
+MAX_REQUEST_SIZE = 64 * 1024
+
+# the commands a watcher answers and the options their results depend on
+WATCHED_COMMANDS = {
+    'branch': ('all', 'hide_empty'),
+    'status': ('hide_empty', 'quiet'),
+}
+
+# the subdirectories of a metadata directory which are watched recursively,
+# besides the files directly in the metadata directory
+METADATA_SUBDIRECTORIES = {'.git': ('refs',), '.bzr': ('branch', 'checkout')}
+
+# the lock files in metadata directories which read-only commands create
+# (e.g. git status while checking if the index needs to be refreshed), an
+# actual modification renames the lock file to the modified file
+LOCK_FILES = {'lock', 'wlock'}
+
+MARKERS = {client_class.marker for client_class in vcs2l_clients if client_class.marker}
+
+# see inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+_EVENT_HEADER = struct.Struct('iIII')
+
+# the kinds of watched directories
+WORKSPACE = 'workspace'
+WORKING_TREE = 'working tree'
+METADATA = 'metadata'
+METADATA_TREE = 'metadata tree'
+
+
+class Inotify(object):
+    """Watch directories for changes using the inotify API of Linux."""
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_error()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Watch the directory and return the watch descriptor."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise_error(path)
+        return wd
+
+    def remove_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Read the pending events as (watch descriptor, mask, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+    def _raise_error(self, path=None):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+
+class WorkspaceWatcher(object):
+    """
+    Track which repositories of a workspace changed and serve their results.
+
+    All directories of the working trees and the relevant parts of the
+    metadata directories (e.g. the index and the refs of git repositories)
+    are watched.
+    Every change increments a generation counter of the repository and the
+    results of a command are only computed again for the repositories whose
+    generation changed since the result was cached.
+    A change to the directories of the workspace outside of repositories
+    (e.g. a new repository) triggers a new crawl before the next query.
+    """
+
+    def __init__(
+        self, path, command_classes, nested=False, max_depth=None, number_of_workers=10
+    ):
+        self.path = path
+        self.nested = nested
+        self.max_depth = max_depth
+        self.number_of_workers = number_of_workers
+        # command name -> Command class
+        self._command_classes = command_classes
+        self._inotify = None
+        # path -> client of the found repositories
+        self._repositories = {}
+        # path -> number of changes of the repository
+        self._generations = {}
+        # the paths of repositories which couldn't be watched completely
+        self._unwatched = set()
+        # watch descriptor -> (repository path or None, directory, kind)
+        self._watches = {}
+        # request key -> {repository path: (generation, encoded result)}
+        self._results = {}
+        self._crawl_needed = True
+
+    def crawl(self):
+        """Find the repositories and watch all directories again."""
+        self.close()
+        self._inotify = Inotify()
+        self._watches.clear()
+        self._unwatched.clear()
+        self._results.clear()
+
+        stamps = []
+        clients = list(crawl_base_path(self.path, self.nested, self.max_depth, stamps))
+        self._repositories = {client.path: client for client in clients}
+        self._generations = dict.fromkeys(self._repositories, 0)
+        for directory, _ in stamps:
+            if directory not in self._repositories and os.path.isdir(directory):
+                self._add_watch(None, directory, WORKSPACE)
+        for path, client in self._repositories.items():
+            self._watch_repository(path, client.__class__.marker)
+        self._crawl_needed = False
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _watch_repository(self, path, marker):
+        self._watch_tree(path, path, WORKING_TREE)
+        if marker is None:
+            return
+        metadata_path = os.path.join(path, marker)
+        self._add_watch(path, metadata_path, METADATA)
+        for name in METADATA_SUBDIRECTORIES.get(marker, ()):
+            subdirectory = os.path.join(metadata_path, name)
+            if os.path.isdir(subdirectory):
+                self._watch_tree(path, subdirectory, METADATA_TREE)
+
+    def _watch_tree(self, repository, directory, kind):
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            # watch the directory before listing it to notice new entries
+            wd = self._add_watch(repository, directory, kind)
+            try:
+                with os.scandir(directory) as entries:
+                    names = [
+                        entry.name
+                        for entry in entries
+                        if entry.is_dir(follow_symlinks=False)
+                    ]
+            except OSError:
+                continue
+            if kind == WORKING_TREE and directory != repository:
+                if MARKERS.intersection(names):
+                    # a nested repository is watched on its own
+                    if wd is not None:
+                        self._inotify.remove_watch(wd)
+                        del self._watches[wd]
+                    if self.nested and directory not in self._repositories:
+                        self._crawl_needed = True
+                    continue
+            for name in names:
+                if kind == WORKING_TREE and name in SKIPPED_DIRECTORIES:
+                    continue
+                directories.append(os.path.join(directory, name))
+
+    def _add_watch(self, repository, directory, kind):
+        try:
+            wd = self._inotify.add_watch(directory)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            if repository is None:
+                warn("Could not watch '%s': %s" % (directory, e.strerror))
+            elif repository not in self._unwatched:
+                # the results of the repository are always computed again
+                self._unwatched.add(repository)
+                warn(
+                    "Could not watch '%s', its results aren't cached: %s"
+                    % (repository, e.strerror)
+                )
+            return None
+        self._watches[wd] = (repository, directory, kind)
+        return wd
+
+    def process_events(self):
+        """Update the generations of the repositories which changed."""
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events have been lost
+                self._crawl_needed = True
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                # the directory has been removed
+                del self._watches[wd]
+                continue
+            repository, directory, kind = watch
+            is_dir = bool(mask & IN_ISDIR)
+            if kind in (METADATA, METADATA_TREE) and (
+                name in LOCK_FILES or name.endswith('.lock')
+            ):
+                continue
+            if kind == WORKSPACE:
+                if (
+                    is_dir
+                    or name == IGNORE_FILE
+                    or mask & (IN_DELETE_SELF | IN_MOVE_SELF)
+                ):
+                    self._crawl_needed = True
+                continue
+
+            self._generations[repository] += 1
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and directory == repository:
+                self._crawl_needed = True
+            elif not is_dir or kind == METADATA:
+                continue
+            elif kind == WORKING_TREE and name in MARKERS:
+                # a repository has been created or removed
+                if directory == repository or self.nested:
+                    self._crawl_needed = True
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(repository, os.path.join(directory, name), kind)
+            elif kind == WORKING_TREE and self.nested:
+                if os.path.join(directory, name) in self._repositories:
+                    self._crawl_needed = True
+
+    def serve_forever(self, socket_path=None):
+        """Answer the queries of commands until interrupted."""
+        if socket_path is None:
+            socket_path = os.path.join(self.path, SOCKET_PATH)
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        if os.path.exists(socket_path):
+            if _is_listening(socket_path):
+                raise RuntimeError(
+                    "Another watcher is already running for '%s'" % self.path
+                )
+            os.remove(socket_path)
+        with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as server:
+            # the results might contain private information, so only the user
+            # may connect to the socket as soon as it has been created
+            umask = os.umask(0o177)
+            try:
+                server.bind(socket_path)
+            finally:
+                os.umask(umask)
+            try:
+                server.listen()
+                self.crawl()
+                while True:
+                    # a new crawl is delayed until the next query
+                    readable, _, _ = select.select([server, self._inotify.fd], [], [])
+                    if self._inotify.fd in readable:
+                        self.process_events()
+                    if server in readable:
+                        connection, _ = server.accept()
+                        with closing(connection):
+                            self._handle_connection(connection)
+            finally:
+                os.remove(socket_path)
+                self.close()
+
+    def _handle_connection(self, connection):
+        connection.settimeout(QUERY_TIMEOUT)
+        try:
+            data = b''
+            while not data.endswith(b'\n') and len(data) < MAX_REQUEST_SIZE:
+                chunk = connection.recv(MAX_REQUEST_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+            try:
+                response = self.query(json.loads(data.decode('utf-8')))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                response = {'error': 'Invalid request: %s' % e}
+            connection.sendall(json.dumps(response).encode('utf-8') + b'\n')
+        except OSError:
+            # the command gave up waiting
+            pass
+
+    def query(self, request):
+        """Get the results of a command for all repositories."""
+        error = self._get_request_error(request)
+        if error:
+            return {'error': error}
+
+        self.process_events()
+        if self._crawl_needed:
+            self.crawl()
+
+        command_name = request['command']
+        options = {
+            name: request['options'][name] for name in WATCHED_COMMANDS[command_name]
+        }
+        results = self._results.setdefault(
+            json.dumps([command_name, options], sort_keys=True), {}
+        )
+        generations = dict(self._generations)
+        stale = [
+            path
+            for path in self._repositories
+            if path in self._unwatched
+            or results.get(path, (None,))[0] != generations[path]
+        ]
+        if stale:
+            command = self._command_classes[command_name](
+                argparse.Namespace(paths=[self.path], **options)
+            )
+            # use new clients since the jobs might replace their methods
+            jobs = executor.generate_jobs(
+                [self._repositories[path].__class__(path) for path in stale], command
+            )
+            for result in executor.execute_jobs(
+                jobs, number_of_workers=self.number_of_workers
+            ):
+                path = result['client'].path
+                results[path] = (generations[path], _encode_result(result, self.path))
+        return {
+            'results': [results[path][1] for path in self._repositories],
+            'computed': len(stale),
+        }
+
+    def _get_request_error(self, request):
+        if request.get('version') != PROTOCOL_VERSION:
+            return 'Unsupported protocol version'
+        if request.get('command') not in self._command_classes:
+            return "Unsupported command '%s'" % request.get('command')
+        if (request.get('nested'), request.get('max_depth')) != (
+            self.nested,
+            self.max_depth,
+        ):
+            return 'The watcher uses different options to find the repositories'
+        if request.get('color') != executor.USE_COLOR:
+            return 'The watcher uses a different colorization'
+        return None
+
+
+def _encode_result(result, base_path):
+    returncode = result['returncode']
+    return {
+        'path': split_path(result['client'].path, base_path),
+        'type': result['client'].__class__.type,
+        'cmd': result['cmd'],
+        'output': str(result['output']),
+        'returncode': None if returncode is NotImplemented else returncode,
+        'duration': result.get('duration'),
+        'not_implemented': returncode is NotImplemented,
+    }
+
+
+def query_watcher(command):
+    """
+    Get the results of the command from a watcher of its path.
+
+    :returns: the list of results or None if no watcher can answer the query
+    """
+    if command.command not in WATCHED_COMMANDS or len(command.paths) != 1:
+        return None
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    path = command.paths[0]
+    socket_path = os.path.join(path, SOCKET_PATH)
+    if not os.path.exists(socket_path):
+        return None
+
+    request = {
+        'version': PROTOCOL_VERSION,
+        'command': command.command,
+        'options': {
+            name: getattr(command, name) for name in WATCHED_COMMANDS[command.command]
+        },
+        'nested': command.nested,
+        'max_depth': command.max_depth,
+        'color': executor.USE_COLOR,
+    }
+    try:
+        with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as client:
+            client.settimeout(QUERY_TIMEOUT)
+            client.connect(socket_path)
+            client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = client.recv(1024 * 1024)
+                if not chunk:
+                    break
+                data += chunk
+        response = json.loads(data.decode('utf-8'))
+        if 'error' in response:
+            if command.debug:
+                warn('The watcher of %s failed: %s' % (path, response['error']))
+            return None
+        client_classes = {c.type: c for c in vcs2l_clients}
+        results = []
+        for data in response['results']:
+            client_path = os.path.join(path, *data['path']) if data['path'] else path
+            results.append(
+                {
+                    'client': client_classes[data['type']](client_path),
+                    'command': command,
+                    'cmd': data['cmd'],
+                    'cwd': client_path,
+                    'output': data['output'],
+                    'returncode': NotImplemented
+                    if data['not_implemented']
+                    else data['returncode'],
+                    # the duration of the job which computed the result
+                    'duration': data['duration'],
+                }
+            )
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        if command.debug:
+            warn('Could not query the watcher of %s: %s' % (path, e))
+        return None
+    return results
+
+
+def _is_listening(socket_path):
+    with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            return False
+    return True